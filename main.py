@@ -7,19 +7,13 @@ RAG评估工具包主程序
 """
 
 import os
-import sys
-import time
-import json
 import argparse
 from datetime import datetime
-from typing import Dict, List, Any, Optional, Union
-import numpy as np
-from pathlib import Path
 
 # 导入自定义模块
+# 数据集和评估模块依赖datasets/ragas等较重的库，在实际用到时再导入，加快--test-only等路径的启动
 from src.test_api import ApiTester
-from src.evaluate_rag import create_metrics, evaluate_dataset
-from src.dataset_manager import ensure_dataset, get_default_dataset_path, DEFAULT_DATASETS
+from src.custom_api_client import positive_int
 
 # ======== API 配置 ========
 # API密钥配置，用户需要在此处填入自己的API密钥
@@ -125,6 +119,7 @@ def download_and_prepare_dataset(dataset_type="mldr", force_download=False):
     
     try:
         # 使用dataset_manager中的函数确保数据集存在
+        from src.dataset_manager import ensure_dataset
         dataset_path = ensure_dataset(dataset_type, force_download)
         print(f"数据集准备完成: {dataset_path}")
         return dataset_path
@@ -164,6 +159,13 @@ def parse_args():
                           help="批处理大小，避免一次性评估太多样本")
     eval_group.add_argument("--metrics", type=str, default="accuracy,completeness,relevance", 
                           help="要使用的评估指标，用逗号分隔")
+    eval_group.add_argument("--concurrency", type=positive_int, default=4, 
+                          help="同时评估的批次数，受API速率限制约束")
+    eval_group.add_argument("--marshal-size", type=int, default=1, 
+                          help="合并到同一次LLM请求中评分的样本数，1表示逐个评分；"
+                               "大于1时使用不含推理过程和示例的合并提示词，分数与逐个评分不可直接比较")
+    eval_group.add_argument("--llm-cache", action="store_true", 
+                          help="缓存LLM响应到evaluation_results/.llm_cache.pkl，重复评估同一数据集时复用")
     
     # 输出相关参数
     output_group = parser.add_argument_group('输出选项')
@@ -259,8 +261,11 @@ def main():
     # 执行评估
     try:
         print("\n开始执行RAG评估...")
+        from src.evaluate_rag import create_metrics, evaluate_dataset
+        from src.custom_api_client import DEFAULT_CACHE_PATH
+        
         # 创建评估指标
-        metric_objects = create_metrics(args.metrics.split(","))
+        metric_objects = create_metrics(args.metrics.split(","), args.marshal_size)
         
         # 使用evaluate_rag模块进行评估
         evaluate_dataset(
@@ -273,7 +278,9 @@ def main():
             visualize=args.visualize,
             api_key=API_KEY,
             api_base_url=API_BASE_URL,
-            api_model=API_MODEL
+            api_model=API_MODEL,
+            max_concurrency=args.concurrency,
+            llm_cache_path=DEFAULT_CACHE_PATH if args.llm_cache else None
         )
         print(f"评估完成! 结果已保存到: {output_file}")
         print(f"JSON格式评估结果已保存到: {json_output}")
@@ -2,7 +2,14 @@
 RAG评估可视化工具
 """
 
-from src.visualize import visualize_evaluation
-from src.data_processor import process_dataset
+__version__ = "1.0.0"
 
-__version__ = "1.0.0" 
\ No newline at end of file
+def __getattr__(name):
+    """按需导入公共函数，避免导入任一子模块时都加载pandas和datasets"""
+    if name == "visualize_evaluation":
+        from src.visualize import visualize_evaluation
+        return visualize_evaluation
+    if name == "process_dataset":
+        from src.data_processor import process_dataset
+        return process_dataset
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
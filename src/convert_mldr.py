@@ -8,11 +8,32 @@ MLDR数据集转换脚本
 
 import os
 import argparse
-import json
-from datasets import Dataset, load_from_disk
-import pandas as pd
-import time
-import shutil
+import orjson
+import tempfile
+from datasets import Features, Value, load_from_disk
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import logging
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# 转换时每批处理和写入磁盘的记录数
+WRITER_BATCH_SIZE = 1000
+
+# 块采样时每个连续块包含的样本数
+SAMPLE_BLOCK_SIZE = 64
+
+# 转换后数据集的字段结构，显式声明以跳过类型推断
+OUTPUT_FEATURES = Features({
+    "query": Value("string"),
+    "query_id": Value("string"),
+    "doc_id": Value("string"),
+    "context": Value("string"),
+    "answer": Value("string")
+})
 
 def parse_args():
     """解析命令行参数"""
@@ -22,11 +43,91 @@ def parse_args():
     parser.add_argument("--language", type=str, default="zh", help="要处理的语言代码")
     parser.add_argument("--split", type=str, default="test", help="要处理的数据分割(train/dev/test)")
     parser.add_argument("--samples", type=int, default=0, help="要处理的样本数量，0表示全部")
+    parser.add_argument("--sampling", type=str, default="head", choices=["head", "block"],
+                        help="采样方式: head取前N个样本，block随机选取若干连续块")
+    parser.add_argument("--seed", type=int, default=None, help="块采样的随机种子")
     return parser.parse_args()
 
-def convert_mldr_to_ragas(input_dir, output_dir, language="zh", split="test", samples=0):
+def _expand_passages(batch, corpus_ids, corpus_texts, corpus_index, stats):
+    """
+    将一批查询按正面段落展开，每个正面段落对应一条记录
+    
+    展开和筛选均使用Arrow计算内核完成，只有缺少内联文本的段落才回查语料库
+    
+    参数:
+        batch: 查询数据批次(Arrow表)
+        corpus_ids: 语料库文档ID列
+        corpus_texts: 语料库文档文本列，与corpus_ids按行对应
+        corpus_index: 文档ID到语料库行号的字典，各批次共用，第一次需要回查时才构建
+        stats: 跳过计数，原地累加
+        
+    返回:
+        转换后的Arrow表
+    """
+    passages = batch.column("positive_passages").combine_chunks()
+    no_passage = pc.fill_null(pc.equal(pc.list_value_length(passages), 0), True)
+    stats["skipped_queries"] += pc.sum(no_passage).as_py() or 0
+    
+    # 每个段落所属查询的行号
+    parents = pc.list_parent_indices(passages)
+    flat = pc.list_flatten(passages)
+    doc_ids = pc.struct_field(flat, "docid")
+    
+    # 获取文档内容，段落自带文本为空时回退到语料库
+    contexts = pc.struct_field(flat, "text")
+    missing = pc.fill_null(pc.equal(contexts, ""), True)
+    if pc.any(missing).as_py():
+        if not corpus_index:
+            corpus_index.update(zip(corpus_ids.to_pylist(), range(len(corpus_ids))))
+        positions = pa.array([corpus_index.get(doc_id) for doc_id in doc_ids.filter(missing).to_pylist()], type=pa.int64())
+        fallback = pc.take(corpus_texts, positions).combine_chunks().cast(contexts.type)
+        contexts = pc.replace_with_mask(contexts, missing, fallback)
+    
+    keep = pc.fill_null(pc.not_equal(contexts, ""), False)
+    stats["skipped_passages"] += len(keep) - (pc.sum(keep).as_py() or 0)
+    
+    rows = pc.filter(parents, keep)
+    return pa.table({
+        "query": pc.take(batch.column("query"), rows),
+        "query_id": pc.take(batch.column("query_id"), rows),
+        "doc_id": pc.filter(doc_ids, keep),
+        "context": pc.filter(contexts, keep),
+        "answer": pa.repeat(pa.scalar("", type=pa.string()), len(rows))  # RAG评估通常需要回答，但MLDR不提供，留空
+    }, schema=OUTPUT_FEATURES.arrow_schema)
+
+def _select_samples(dataset, samples, sampling="head", seed=None, block_size=SAMPLE_BLOCK_SIZE):
+    """
+    从数据集中选取样本，两种方式都只产生连续的行区间，读取时为顺序I/O
+    
+    参数:
+        dataset: 查询数据集
+        samples: 要选取的样本数量
+        sampling: "head"取前samples个样本，"block"随机选取若干互不重叠的连续块
+        seed: 块采样的随机种子
+        block_size: 每个连续块包含的样本数
+        
+    返回:
+        选取后的数据集
+    """
+    if sampling == "block":
+        block_size = min(block_size, samples)
+        num_blocks = -(-samples // block_size)
+        num_slots = len(dataset) // block_size
+        if num_blocks <= num_slots:
+            # 块起点按升序排列，保证整体仍按原始顺序扫描
+            rng = np.random.default_rng(seed)
+            starts = np.sort(rng.choice(num_slots, size=num_blocks, replace=False)) * block_size
+            indices = (starts[:, None] + np.arange(block_size)).ravel()[:samples]
+            return dataset.select(indices)
+        logger.warning(f"样本数 {samples} 接近数据集大小，无法划分为不重叠的块，改为取前 {samples} 个样本")
+    elif sampling != "head":
+        raise ValueError(f"不支持的采样方式: {sampling}")
+    
+    return dataset.select(range(samples))
+
+def convert_mldr_to_ragas(input_dir, output_dir, language="zh", split="test", samples=0, sampling="head", seed=None):
     """将MLDR数据集转换为RAG评估工具可用的格式"""
-    print(f"开始转换MLDR数据集 ({language}-{split})...")
+    logger.info(f"开始转换MLDR数据集 ({language}-{split})...")
     
     # 确保输出目录存在
     os.makedirs(output_dir, exist_ok=True)
@@ -34,90 +135,76 @@ def convert_mldr_to_ragas(input_dir, output_dir, language="zh", split="test", sa
     try:
         # 加载语料库
         corpus_path = os.path.join(input_dir, f"{language}-corpus")
-        print(f"加载语料库: {corpus_path}")
+        logger.info(f"加载语料库: {corpus_path}")
         corpus = load_from_disk(corpus_path)
         
-        # 创建文档ID到文本的映射
-        doc_map = {}
-        for doc in corpus:
-            doc_map[doc["docid"]] = doc["text"]
+        # 直接使用内存映射的Arrow列，只有段落缺少内联文本时才构建文档ID索引
+        corpus_ids = corpus.data.column("docid")
+        corpus_texts = corpus.data.column("text")
+        corpus_index = {}
         
-        print(f"已加载语料库，共 {len(doc_map)} 个文档")
+        logger.info(f"已加载语料库，共 {len(corpus)} 个文档")
         
         # 加载查询数据集
         dataset_path = os.path.join(input_dir, f"{language}-{split}")
-        print(f"加载查询数据集: {dataset_path}")
+        logger.info(f"加载查询数据集: {dataset_path}")
         dataset = load_from_disk(dataset_path)
         
         # 限制样本数量
         if samples > 0 and samples < len(dataset):
-            dataset = dataset.select(range(samples))
-            print(f"已选择 {samples} 个样本进行处理")
+            dataset = _select_samples(dataset, samples, sampling, seed)
+            logger.info(f"已按 {sampling} 方式选择 {samples} 个样本进行处理")
         else:
-            print(f"将处理全部 {len(dataset)} 个样本")
+            logger.info(f"将处理全部 {len(dataset)} 个样本")
         
-        # 准备转换后的数据
-        converted_data = []
-        
-        # 处理每个查询
-        for idx, item in enumerate(dataset):
-            query = item["query"]
-            query_id = item["query_id"]
+        # 分批展开正面段落并增量写入Arrow文件，避免整个数据集驻留内存
+        stats = {"skipped_queries": 0, "skipped_passages": 0}
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output_dataset = dataset.with_format("arrow").map(
+                _expand_passages,
+                batched=True,
+                batch_size=WRITER_BATCH_SIZE,
+                writer_batch_size=WRITER_BATCH_SIZE,
+                remove_columns=dataset.column_names,
+                features=OUTPUT_FEATURES,
+                fn_kwargs={"corpus_ids": corpus_ids, "corpus_texts": corpus_texts, "corpus_index": corpus_index, "stats": stats},
+                cache_file_name=os.path.join(tmp_dir, "converted.arrow"),
+                new_fingerprint=f"mldr_ragas_{language}_{split}_{samples}_{sampling}_{seed}",
+                desc="转换MLDR数据"
+            )
             
-            # 获取正面段落
-            positive_passages = item["positive_passages"]
-            if not positive_passages:
-                print(f"警告: 查询 {query_id} 没有正面段落，跳过")
-                continue
+            if stats["skipped_queries"] or stats["skipped_passages"]:
+                logger.warning(f"跳过 {stats['skipped_queries']} 个没有正面段落的查询，{stats['skipped_passages']} 个内容为空的文档")
             
-            # 为每个正面段落创建一条记录
-            for passage in positive_passages:
-                doc_id = passage["docid"]
-                # 获取文档内容
-                context = passage["text"] if "text" in passage and passage["text"] else doc_map.get(doc_id, "")
-                
-                if not context:
-                    print(f"警告: 文档 {doc_id} 内容为空，跳过")
-                    continue
-                
-                # 添加到转换数据中
-                converted_data.append({
-                    "query": query,
-                    "query_id": query_id,
-                    "doc_id": doc_id,
-                    "context": context,
-                    "answer": ""  # RAG评估通常需要回答，但MLDR不提供，留空
-                })
-        
-        # 创建Pandas DataFrame
-        df = pd.DataFrame(converted_data)
+            # 保存为Arrow格式
+            logger.info(f"转换完成，共处理 {len(output_dataset)} 条记录")
+            output_dataset = output_dataset.with_format(None)
+            output_dataset.save_to_disk(output_dir)
         
-        # 保存为Arrow格式
-        print(f"转换完成，共处理 {len(df)} 条记录")
-        output_dataset = Dataset.from_pandas(df)
-        output_dataset.save_to_disk(output_dir)
+        # 临时目录中的缓存文件已删除，改为引用保存到输出目录的数据
+        output_dataset = load_from_disk(output_dir)
         
         # 保存数据集信息
         dataset_info = {
             "language": language,
             "split": split,
             "original_samples": len(dataset),
-            "converted_samples": len(df),
+            "converted_samples": len(output_dataset),
             "description": "从MLDR数据集转换的RAG评估数据"
         }
         
-        with open(os.path.join(output_dir, "dataset_info.json"), "w", encoding="utf-8") as f:
-            json.dump(dataset_info, f, ensure_ascii=False, indent=2)
+        with open(os.path.join(output_dir, "dataset_info.json"), "wb") as f:
+            f.write(orjson.dumps(dataset_info, option=orjson.OPT_INDENT_2))
         
-        print(f"\n转换成功! 数据已保存到: {output_dir}")
-        print(f"转换后样本数量: {len(df)}")
+        logger.info(f"转换成功! 数据已保存到: {output_dir}")
+        logger.info(f"转换后样本数量: {len(output_dataset)}")
         
         return True
     
     except Exception as e:
-        print(f"转换过程中出现错误: {e}")
+        logger.error(f"转换过程中出现错误: {e}")
         import traceback
-        traceback.print_exc()
+        logger.error(traceback.format_exc())
         return False
 
 def main():
@@ -130,7 +217,9 @@ def main():
         output_dir=args.output_dir,
         language=args.language,
         split=args.split,
-        samples=args.samples
+        samples=args.samples,
+        sampling=args.sampling,
+        seed=args.seed
     )
 
 if __name__ == "__main__":
@@ -2,17 +2,159 @@
 定义一个自定义的LLM客户端，使用用户提供的API配置
 """
 
-import json
+import os
+import atexit
+import argparse
+import asyncio
+import pickle
+import hashlib
+import functools
+import threading
+import collections
+import orjson
 import requests
-from typing import List, Dict, Any, Optional, Union, Generator
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from typing import List, Dict, Any, Optional, Generator
 from langchain.llms.base import LLM
-from langchain.callbacks.manager import CallbackManagerForLLMRun
-from langchain.schema import LLMResult
+from langchain_core.outputs import Generation, LLMResult
+
+try:
+    import fcntl
+except ImportError:  # Windows上没有fcntl，此时不做跨进程加锁
+    fcntl = None
+
+# 连接池与重试配置
+POOL_SIZE = 32
+RETRY_TOTAL = 3
+RETRY_BACKOFF_FACTOR = 0.3
+RETRY_STATUS_FORCELIST = [429, 500, 502, 503, 504]
+# 请求超时(连接超时, 读取超时)，单位秒
+REQUEST_TIMEOUT = (5, 60)
+# 流式请求超时，读取超时放宽以容纳长时间生成
+STREAM_TIMEOUT = (5, 300)
+# 流式响应每次读取的字节数
+STREAM_CHUNK_SIZE = 65536
+# 开启响应缓存(--llm-cache)时使用的缓存文件，默认不缓存
+DEFAULT_CACHE_PATH = "evaluation_results/.llm_cache.pkl"
+# 批量调用时的默认并发请求数
+DEFAULT_CONCURRENCY = 8
+
+def positive_int(value: str) -> int:
+    """
+    argparse参数类型：至少为1的整数，用于各命令行的并发数等参数
+    
+    定义在本模块中，main.py启动时无需导入评估模块即可使用
+    
+    参数:
+        value: 命令行中的参数文本
+        
+    返回:
+        解析后的整数
+    """
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"必须是至少为1的整数: {value}")
+    return number
+
+@functools.lru_cache(maxsize=None)
+def _shared_session() -> requests.Session:
+    """
+    创建进程内共享的HTTP会话，带连接池和自动重试
+    
+    API测试和评估阶段创建的多个客户端都复用这个会话，已建立的TCP+TLS连接可以跨客户端复用
+    
+    返回:
+        配置好的requests会话
+    """
+    retry = Retry(
+        total=RETRY_TOTAL,
+        backoff_factor=RETRY_BACKOFF_FACTOR,
+        status_forcelist=RETRY_STATUS_FORCELIST,
+        allowed_methods=None  # 对话接口使用POST，默认不会重试POST
+    )
+    adapter = HTTPAdapter(
+        pool_connections=POOL_SIZE,
+        pool_maxsize=POOL_SIZE,
+        max_retries=retry
+    )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+# 进程内的响应缓存，按缓存文件路径共享：同一路径的所有客户端使用同一个字典，
+# 新增条目另外记录，进程退出时与磁盘上的内容合并后统一写回
+_cache_lock = threading.Lock()
+_caches: Dict[str, Dict[str, str]] = {}
+_pending: Dict[str, Dict[str, str]] = {}
+
+def _read_cache_file(cache_path: str) -> Dict[str, str]:
+    """
+    读取磁盘上的响应缓存文件
+    
+    参数:
+        cache_path: 缓存文件路径
+        
+    返回:
+        缓存键到响应内容的字典，文件不存在或无法读取时为空字典
+    """
+    if not os.path.exists(cache_path):
+        return {}
+    try:
+        with open(cache_path, "rb") as f:
+            return pickle.load(f)
+    except Exception as e:
+        print(f"警告: 无法加载LLM响应缓存，将重新创建: {e}")
+        return {}
+
+def _get_cache(cache_path: str) -> Dict[str, str]:
+    """返回指定路径的进程内缓存，第一次使用时从磁盘加载"""
+    with _cache_lock:
+        if cache_path not in _caches:
+            _caches[cache_path] = _read_cache_file(cache_path)
+            _pending[cache_path] = {}
+            if _caches[cache_path]:
+                print(f"已加载 {len(_caches[cache_path])} 条LLM响应缓存: {cache_path}")
+        return _caches[cache_path]
+
+def _add_to_cache(cache_path: str, key: str, content: str) -> None:
+    """记录一条新的响应，等待写回磁盘"""
+    with _cache_lock:
+        _caches[cache_path][key] = content
+        _pending[cache_path][key] = content
+
+def flush_caches() -> None:
+    """
+    将各缓存中新增的条目写回磁盘
+    
+    写入前在文件锁内重新读取磁盘上的缓存并合并，多个进程或先后运行共用同一缓存文件时不会互相覆盖
+    """
+    with _cache_lock:
+        for cache_path, entries in _pending.items():
+            if not entries:
+                continue
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+                with open(cache_path + ".lock", "w") as lock_file:
+                    if fcntl is not None:
+                        fcntl.flock(lock_file, fcntl.LOCK_EX)
+                    cache = _read_cache_file(cache_path)
+                    cache.update(entries)
+                    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+                    with open(tmp_path, "wb") as f:
+                        pickle.dump(cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+                    os.replace(tmp_path, cache_path)
+                entries.clear()
+            except Exception as e:
+                print(f"警告: 无法保存LLM响应缓存: {e}")
+
+atexit.register(flush_caches)
 
 class CustomLLMClient:
     """自定义LLM客户端，使用第三方API"""
     
-    def __init__(self, api_url, api_key, model_name):
+    def __init__(self, api_url, api_key, model_name, cache_path=None):
         """
         初始化LLM客户端
         
@@ -20,6 +162,7 @@ class CustomLLMClient:
             api_url: API基础URL
             api_key: API密钥
             model_name: 模型名称
+            cache_path: 响应缓存文件路径，为None时不缓存(默认)
         """
         # 保存API配置
         self.api_url = api_url
@@ -35,19 +178,50 @@ class CustomLLMClient:
             "Content-Type": "application/json",
             "Authorization": f"Bearer {self.api_key}"
         }
+        
+        # 使用进程内共享的会话，避免每次请求(以及每个新客户端)都重新进行TCP+TLS握手
+        self.session = _shared_session()
+        
+        # 响应缓存，同一缓存文件的所有客户端共享，进程退出时统一写回磁盘
+        self.cache_path = cache_path
+        self._cache = _get_cache(cache_path) if cache_path else None
+    
+    def save_cache(self):
+        """立即将新增的响应缓存写回磁盘(进程退出时也会自动写回)"""
+        flush_caches()
+    
+    @staticmethod
+    def _cache_key(data: Dict, sample_index: int, num_samples: int) -> str:
+        """
+        根据完整的请求数据和采样参数生成缓存键
+        
+        参数:
+            data: 发送给API的请求数据(模型、消息及所有生成参数)
+            sample_index: 同一请求多次采样时的序号
+            num_samples: 同一请求的采样次数(如ragas指标的strictness)
+            
+        返回:
+            缓存键
+        """
+        payload = orjson.dumps(
+            {"request": data, "sample_index": sample_index, "num_samples": num_samples},
+            option=orjson.OPT_SORT_KEYS
+        )
+        return hashlib.sha1(payload).hexdigest()
     
-    def _prepare_request_data(self, prompt: str, stream: bool = False) -> Dict:
+    def _prepare_request_data(self, prompt: str, stream: bool = False, stop: Optional[List[str]] = None) -> Dict:
         """
         准备请求数据，避免代码重复
         
         参数:
             prompt: 提示文本
             stream: 是否使用流式响应
+            stop: 停止序列，为None时不发送
             
         返回:
             请求数据字典
         """
-        return {
+        data = {
             "model": self.model_name,
             "messages": [
                 {"role": "system", "content": "You are a helpful assistant."},
@@ -55,34 +229,82 @@ class CustomLLMClient:
             ],
             "stream": stream
         }
+        if stop:
+            data["stop"] = stop
+        return data
     
-    def _call(self, prompt: str, **kwargs) -> str:
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, sample_index: int = 0, num_samples: int = 1, **kwargs) -> str:
         """
         调用API获取非流式响应
         
         参数:
             prompt: 提示文本
+            stop: 停止序列
+            sample_index: 同一请求多次采样时的序号，只用于区分缓存条目
+            num_samples: 同一请求的采样次数，只用于区分缓存条目
             
         返回:
             API响应内容
         """
-        data = self._prepare_request_data(prompt, stream=False)
+        data = self._prepare_request_data(prompt, stream=False, stop=stop)
+        if self._cache is not None:
+            cache_key = self._cache_key(data, sample_index, num_samples)
+            if cache_key in self._cache:
+                return self._cache[cache_key]
         
         print(f"发送请求到 {self.api_url}...")
         print(f"使用模型: {self.model_name}")
         
         try:
-            response = requests.post(self.api_url, headers=self.headers, json=data)
+            response = self.session.post(self.api_url, headers=self.headers, data=orjson.dumps(data), timeout=REQUEST_TIMEOUT)
             response.raise_for_status()
             result = response.json()
             print("请求成功!")
-            return result["choices"][0]["message"]["content"]
+            content = result["choices"][0]["message"]["content"]
+            if self._cache is not None:
+                _add_to_cache(self.cache_path, cache_key, content)
+            return content
         except requests.exceptions.RequestException as e:
             print(f"API请求失败: {e}")
             if hasattr(e, 'response') and e.response:
                 print(f"错误响应: {e.response.text}")
             raise Exception(f"API调用失败: {str(e)}")
     
+    async def acall(self, prompt: str, **kwargs) -> str:
+        """
+        异步调用API获取非流式响应
+        
+        请求在线程池中通过共享的连接池会话发出，不阻塞事件循环
+        
+        参数:
+            prompt: 提示文本
+            **kwargs: 传给_call的其他参数(stop、sample_index、num_samples)
+            
+        返回:
+            API响应内容
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(self._call, prompt, **kwargs))
+    
+    async def batch_call(self, prompts: List[str], concurrency: int = DEFAULT_CONCURRENCY) -> List[str]:
+        """
+        并发调用API处理多个提示
+        
+        参数:
+            prompts: 提示文本列表
+            concurrency: 最大并发请求数
+            
+        返回:
+            与prompts顺序一致的响应内容列表
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def _limited_call(prompt):
+            async with semaphore:
+                return await self.acall(prompt)
+        
+        return await asyncio.gather(*[_limited_call(p) for p in prompts])
+    
     def stream_chat(self, prompt: str, **kwargs) -> Generator[str, None, str]:
         """
         调用API获取流式响应
@@ -99,26 +321,26 @@ class CustomLLMClient:
         print(f"使用模型: {self.model_name}")
         
         try:
-            response = requests.post(self.api_url, headers=self.headers, json=data, stream=True)
-            response.raise_for_status()
-            
-            full_response = ""
-            for line in response.iter_lines():
-                if line:
-                    line = line.decode('utf-8')
-                    if line.startswith('data:'):
+            # 响应结束或生成器被提前关闭时释放连接，使其回到连接池
+            with self.session.post(self.api_url, headers=self.headers, data=orjson.dumps(data), stream=True, timeout=STREAM_TIMEOUT) as response:
+                response.raise_for_status()
+                
+                full_response = ""
+                for line in response.iter_lines(chunk_size=STREAM_CHUNK_SIZE):
+                    # 直接在字节上匹配前缀，避免逐行解码
+                    if line.startswith(b'data:'):
                         data_str = line[5:].strip()
-                        if data_str != "[DONE]":
+                        if data_str != b"[DONE]":
                             try:
-                                data_json = json.loads(data_str)
+                                data_json = orjson.loads(data_str)
                                 if "choices" in data_json and len(data_json["choices"]) > 0:
                                     delta = data_json["choices"][0].get("delta", {})
                                     if "content" in delta:
                                         content = delta["content"]
                                         full_response += content
                                         yield content
-                            except json.JSONDecodeError:
-                                print(f"无法解析响应: {data_str}")
+                            except orjson.JSONDecodeError:
+                                print(f"无法解析响应: {data_str.decode('utf-8', errors='replace')}")
             
             return full_response
         except requests.exceptions.RequestException as e:
@@ -132,8 +354,10 @@ class LangchainCustomLLMWrapper(LLM):
     """为Ragas评估提供的LangChain兼容LLM包装器"""
     
     client: Optional[CustomLLMClient] = None
+    # 每个提示的采样次数，ragas按指标的strictness设置，每次采样单独请求并单独缓存
+    n: int = 1
     
-    def __init__(self, api_key, api_url, model_name, **kwargs):
+    def __init__(self, api_key, api_url, model_name, cache_path=None, **kwargs):
         """
         初始化LLM客户端
         
@@ -141,6 +365,7 @@ class LangchainCustomLLMWrapper(LLM):
             api_key: API密钥
             api_url: API基础URL
             model_name: 模型名称
+            cache_path: 响应缓存文件路径，为None时不缓存(默认)
         """
         super().__init__(**kwargs)
         
@@ -151,7 +376,7 @@ class LangchainCustomLLMWrapper(LLM):
         self.model_name = model_name
         
         # 初始化客户端
-        self.client = CustomLLMClient(self.api_url, self.api_key, self.model_name)
+        self.client = CustomLLMClient(self.api_url, self.api_key, self.model_name, cache_path=cache_path)
     
     @property
     def _llm_type(self) -> str:
@@ -161,11 +386,67 @@ class LangchainCustomLLMWrapper(LLM):
     def _call(self, prompt: str, stop=None, run_manager=None, **kwargs) -> str:
         """LangChain LLM _call方法实现"""
         try:
-            return self.client._call(prompt)
+            return self.client._call(prompt, stop=stop, **kwargs)
+        except Exception as e:
+            print(f"API调用失败: {e}")
+            raise e
+    
+    async def _acall(self, prompt: str, stop=None, run_manager=None, **kwargs) -> str:
+        """LangChain LLM _acall方法实现，供Ragas并发评估使用"""
+        try:
+            return await self.client.acall(prompt, stop=stop, **kwargs)
         except Exception as e:
             print(f"API调用失败: {e}")
             raise e
     
+    @staticmethod
+    def _sample_offsets(prompts: List[str], num_samples: int) -> List[int]:
+        """
+        计算每个提示的采样序号起点
+        
+        ragas在同步调用等情况下通过发送[prompt] * n获得n个回答，同一次调用中重复的提示代表不同的采样，
+        按提示在本次调用中的出现次数顺延序号，使每份副本单独请求、单独缓存
+        
+        参数:
+            prompts: 本次调用的提示列表
+            num_samples: 每个提示的采样次数
+            
+        返回:
+            与prompts对应的采样序号起点列表
+        """
+        seen = collections.Counter()
+        offsets = []
+        for prompt in prompts:
+            offsets.append(seen[prompt] * num_samples)
+            seen[prompt] += 1
+        return offsets
+    
+    def _generate(self, prompts: List[str], stop=None, run_manager=None, **kwargs) -> LLMResult:
+        """为每个提示生成n个回答，每次采样带上序号，分别请求和缓存"""
+        num_samples = max(1, self.n)
+        offsets = self._sample_offsets(prompts, num_samples)
+        return LLMResult(generations=[
+            [
+                Generation(text=self._call(prompt, stop=stop, sample_index=offset + k, num_samples=num_samples))
+                for k in range(num_samples)
+            ]
+            for prompt, offset in zip(prompts, offsets)
+        ])
+    
+    async def _agenerate(self, prompts: List[str], stop=None, run_manager=None, **kwargs) -> LLMResult:
+        """_generate的异步版本，所有提示和采样并发请求"""
+        num_samples = max(1, self.n)
+        offsets = self._sample_offsets(prompts, num_samples)
+        texts = await asyncio.gather(*[
+            self._acall(prompt, stop=stop, sample_index=offset + k, num_samples=num_samples)
+            for prompt, offset in zip(prompts, offsets)
+            for k in range(num_samples)
+        ])
+        return LLMResult(generations=[
+            [Generation(text=text) for text in texts[i * num_samples:(i + 1) * num_samples]]
+            for i in range(len(prompts))
+        ])
+    
     @property
     def _identifying_params(self) -> Dict[str, Any]:
         """返回标识参数"""
@@ -2,14 +2,18 @@ import os
 import argparse
 from datasets import load_dataset
 import numpy as np
-from random import random
-import json
+import pyarrow as pa
+import pyarrow.compute as pc
+import orjson
 import logging
 
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# 生成模拟评估指标使用的随机数生成器
+_rng = np.random.default_rng()
+
 def generate_evaluation_metrics(count, seed=None):
     """
     生成评估指标（在实际应用中应替换为真实计算结果）
@@ -21,9 +25,48 @@ def generate_evaluation_metrics(count, seed=None):
     Returns:
         list: 生成的随机评估指标
     """
-    if seed is not None:
-        np.random.seed(seed)
-    return [round(random(), 2) for _ in range(count)]
+    rng = np.random.default_rng(seed) if seed is not None else _rng
+    return np.round(rng.random(count), 2).tolist()
+
+def _is_list_type(arrow_type):
+    """判断Arrow类型是否为列表类型"""
+    return pa.types.is_list(arrow_type) or pa.types.is_large_list(arrow_type)
+
+def _to_list_column(column):
+    """
+    将Arrow列转换为列表格式，标量值包装为单元素列表
+    
+    Args:
+        column (pa.ChunkedArray): 原始列
+        
+    Returns:
+        list: 每个元素均为列表的Python列表
+    """
+    if _is_list_type(column.type):
+        return column.to_pylist()
+    values = column.combine_chunks()
+    offsets = pa.array(range(len(values) + 1), type=pa.int32())
+    return pa.ListArray.from_arrays(offsets, values).to_pylist()
+
+def _to_first_element_column(column):
+    """
+    将Arrow列转换为标量格式，列表值取第一个元素，空列表取空字符串
+    
+    Args:
+        column (pa.ChunkedArray): 原始列
+        
+    Returns:
+        list: 标量值的Python列表
+    """
+    if not _is_list_type(column.type):
+        return column.to_pylist()
+    # 空列表先置为null再取第一个元素，不依赖列表元素的类型；值为null的行保持为null
+    non_empty = pc.greater(pc.list_value_length(column), 0)
+    first = pc.list_element(pc.if_else(non_empty, column, pa.scalar(None, type=column.type)), 0)
+    if pa.types.is_string(first.type) or pa.types.is_large_string(first.type):
+        return pc.if_else(non_empty, first, pa.scalar("", type=first.type)).to_pylist()
+    # 非字符串元素无法和空字符串放在同一Arrow列中，逐个替换
+    return ["" if keep is False else value for value, keep in zip(first.to_pylist(), non_empty.to_pylist())]
 
 def load_data(dataset_name, subset=None, trust_remote_code=True):
     """
@@ -88,33 +131,34 @@ def prepare_evaluation_data(dataset, split="eval", sample_size=None, include_met
     # 准备评估批次结果
     batch_results = {}
     
+    # 为每个标准字段解析出数据集中第一个存在的候选字段名
+    available_columns = set(eval_data.column_names)
+    resolved_fields = {
+        standard_field: next((name for name in possible_names if name in available_columns), None)
+        for standard_field, possible_names in field_mapping.items()
+    }
+    
+    # 只读取用到的字段，并一次性在Arrow表上截取样本，避免逐元素的Python处理
+    used_columns = [name for name in resolved_fields.values() if name is not None]
+    table = eval_data.select_columns(used_columns).with_format("arrow")[:sample_size]
+    
     # 处理每个标准字段
-    for standard_field, possible_names in field_mapping.items():
-        found = False
-        for field_name in possible_names:
-            if field_name in eval_data.column_names:
-                if standard_field == 'context':
-                    # 处理上下文字段，确保是列表格式
-                    batch_results['retrieved_contexts'] = [
-                        ctx if isinstance(ctx, list) else [ctx] 
-                        for ctx in eval_data[field_name][:sample_size]
-                    ]
-                elif standard_field == 'ground_truth':
-                    # 处理参考答案字段
-                    batch_results['reference'] = [
-                        gt if not isinstance(gt, list) else gt[0] if len(gt) > 0 else "" 
-                        for gt in eval_data[field_name][:sample_size]
-                    ]
-                elif standard_field == 'question':
-                    batch_results['user_input'] = eval_data[field_name][:sample_size]
-                elif standard_field == 'answer':
-                    batch_results['response'] = eval_data[field_name][:sample_size]
-                
-                found = True
-                break
+    for standard_field, field_name in resolved_fields.items():
+        if field_name is None:
+            logger.warning(f"未找到字段: {standard_field}, 可能的字段名: {field_mapping[standard_field]}")
+            continue
         
-        if not found:
-            logger.warning(f"未找到字段: {standard_field}, 可能的字段名: {possible_names}")
+        column = table.column(field_name)
+        if standard_field == 'context':
+            # 处理上下文字段，确保是列表格式
+            batch_results['retrieved_contexts'] = _to_list_column(column)
+        elif standard_field == 'ground_truth':
+            # 处理参考答案字段
+            batch_results['reference'] = _to_first_element_column(column)
+        elif standard_field == 'question':
+            batch_results['user_input'] = column.to_pylist()
+        elif standard_field == 'answer':
+            batch_results['response'] = column.to_pylist()
     
     # 添加评估指标
     if include_metrics:
@@ -129,8 +173,10 @@ def prepare_evaluation_data(dataset, split="eval", sample_size=None, include_met
             'relevance'
         ]
         
-        for metric in metrics:
-            batch_results[metric] = generate_evaluation_metrics(sample_size)
+        # 一次生成所有指标的数值，再按指标切分
+        values = generate_evaluation_metrics(sample_size * len(metrics))
+        for i, metric in enumerate(metrics):
+            batch_results[metric] = values[i * sample_size:(i + 1) * sample_size]
     
     return batch_results
 
@@ -144,10 +190,13 @@ def save_evaluation_results(batch_results, output_file):
     """
     os.makedirs(os.path.dirname(output_file), exist_ok=True)
     
-    with open(output_file, 'w', encoding='utf-8') as f:
-        f.write(f"批次 1 评估结果:\n")
-        for key, value in batch_results.items():
-            f.write(f"{key}: {value}\n")
+    # 每个字段序列化为一行，整体一次性写入
+    lines = ["批次 1 评估结果:\n".encode('utf-8')]
+    for key, value in batch_results.items():
+        lines.append(key.encode('utf-8') + b": " + orjson.dumps(value, option=orjson.OPT_SERIALIZE_NUMPY) + b"\n")
+    
+    with open(output_file, 'wb') as f:
+        f.write(b"".join(lines))
     
     logger.info(f"评估结果已保存到: {output_file}")
 
@@ -8,11 +8,20 @@
 
 import os
 import json
+import orjson
 import logging
-from pathlib import Path
-import pandas as pd
-from datasets import load_dataset, load_from_disk, Dataset
-from typing import Dict, Tuple, List, Optional, Union, Any
+import time
+import functools
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+import pyarrow as pa
+from typing import Dict, Tuple, List, Optional, Any
+
+try:
+    import fcntl
+except ImportError:  # Windows上没有fcntl，此时不做跨进程加锁
+    fcntl = None
 
 # 导入现有模块中的下载和转换函数
 from src.download_mldr import download_mldr
@@ -32,7 +41,8 @@ DEFAULT_DATASETS = {
         "output_dir": "data/mldr_for_ragas",
         "export_dir": "data/export",
         "split_to_use": "test",
-        "samples": 10
+        "samples": 10,
+        "sampling": "head"  # 采样方式: "head"取前N个样本，"block"随机选取若干连续块
     },
     "msmarco": {
         "dataset_name": "msmarco",
@@ -41,9 +51,48 @@ DEFAULT_DATASETS = {
     }
 }
 
+# 导出JSON时每批读取的记录数，记录中多为长文本，批次较小可降低转换为Python对象时的峰值内存
+EXPORT_BATCH_SIZE = 500
+
+# 预热页缓存时每次读取的字节数
+WARMUP_CHUNK_SIZE = 1 << 20
+
+# 多进程运行时用于协调下载的锁文件和完成标记所在目录
+COORDINATION_DIR = "data"
+
+# 非0号进程等待0号进程准备数据集的超时时间和轮询间隔(秒)
+DOWNLOAD_WAIT_TIMEOUT = 2 * 60 * 60
+DOWNLOAD_POLL_INTERVAL = 5
+
+class _DirCache(threading.local):
+    """
+    按父目录缓存其下的子目录名，同一父目录下的多个路径只需一次scandir，而不是逐个stat
+    
+    缓存按线程隔离，并发准备多个数据集时，一个线程清除或填充缓存不会影响另一个线程看到的目录状态
+    """
+    
+    def __init__(self):
+        self._subdirs: Dict[str, set] = {}
+    
+    def isdir(self, path: str) -> bool:
+        parent, name = os.path.split(os.path.normpath(path))
+        parent = parent or "."
+        if parent not in self._subdirs:
+            try:
+                with os.scandir(parent) as entries:
+                    self._subdirs[parent] = {entry.name for entry in entries if entry.is_dir()}
+            except OSError:
+                self._subdirs[parent] = set()
+        return name in self._subdirs[parent]
+    
+    def clear(self) -> None:
+        self._subdirs.clear()
+
+_dir_cache = _DirCache()
+
 def check_directory_exists(path: str) -> bool:
-    """检查目录是否存在"""
-    return os.path.isdir(path)
+    """检查目录是否存在，结果按父目录缓存，目录发生变化后需调用_dir_cache.clear()"""
+    return _dir_cache.isdir(path)
 
 def check_dataset_exists(dataset_type: str = "mldr") -> Tuple[bool, bool, Dict[str, Any]]:
     """
@@ -72,7 +121,9 @@ def check_dataset_exists(dataset_type: str = "mldr") -> Tuple[bool, bool, Dict[s
         test_path = os.path.join(raw_data_path, f"{language}-test")
         corpus_path = os.path.join(raw_data_path, f"{language}-corpus")
         
-        raw_exists = check_directory_exists(test_path) and check_directory_exists(corpus_path)
+        test_exists = check_directory_exists(test_path)
+        corpus_exists = check_directory_exists(corpus_path)
+        raw_exists = test_exists and corpus_exists
         processed_exists = check_directory_exists(processed_data_path)
         
         # 添加详细信息
@@ -86,8 +137,8 @@ def check_dataset_exists(dataset_type: str = "mldr") -> Tuple[bool, bool, Dict[s
         }
         status_info["details"] = {
             "language": language,
-            "test_exists": check_directory_exists(test_path),
-            "corpus_exists": check_directory_exists(corpus_path)
+            "test_exists": test_exists,
+            "corpus_exists": corpus_exists
         }
         
         return raw_exists, processed_exists, status_info
@@ -113,10 +164,203 @@ def check_dataset_exists(dataset_type: str = "mldr") -> Tuple[bool, bool, Dict[s
     logger.warning(f"不支持的数据集类型: {dataset_type}")
     return False, False, status_info
 
+def _local_rank() -> int:
+    """获取当前进程在本机上的序号，非分布式运行时为0"""
+    return int(os.environ.get("LOCAL_RANK", "0"))
+
+@contextmanager
+def _download_lock(dataset_type: str):
+    """
+    持有指定数据集的跨进程文件锁，保证同一时刻只有一个进程下载或转换该数据集
+    
+    参数:
+        dataset_type: 数据集类型
+    """
+    os.makedirs(COORDINATION_DIR, exist_ok=True)
+    with open(os.path.join(COORDINATION_DIR, f".{dataset_type}.download.lock"), "w") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def _ready_marker(dataset_type: str) -> str:
+    """返回0号进程准备好数据集(或准备失败)后写入的完成标记路径"""
+    return os.path.join(COORDINATION_DIR, f".{dataset_type}.ready")
+
+@functools.lru_cache(maxsize=1)
+def _run_token() -> str:
+    """
+    生成本次运行的标识，同一次启动的各进程得到相同的值，不同次启动的值不同
+    
+    各进程由同一个启动器(如torchrun)派生，使用父进程号及其启动时间，
+    并加上启动器设置的运行ID和端口(存在时)
+    """
+    parts = [str(os.getppid())]
+    try:
+        with open(f"/proc/{os.getppid()}/stat", "r") as f:
+            # 进程名可能包含空格，从最后一个")"之后开始切分，第20项为进程启动时间
+            parts.append(f.read().rsplit(")", 1)[1].split()[19])
+    except (OSError, IndexError):
+        pass
+    for name in ("TORCHELASTIC_RUN_ID", "TORCHELASTIC_RESTART_COUNT", "MASTER_PORT"):
+        if name in os.environ:
+            parts.append(os.environ[name])
+    return ":".join(parts)
+
+def _write_marker(dataset_type: str, status: str, error: str = "") -> None:
+    """
+    写入带本次运行标识的完成标记，其余进程据此判断0号进程是否已完成及是否成功
+    
+    参数:
+        dataset_type: 数据集类型
+        status: "ok"或"failed"
+        error: 失败时的错误信息
+    """
+    with open(_ready_marker(dataset_type), "wb") as f:
+        f.write(orjson.dumps({"run": _run_token(), "status": status, "error": error}))
+
+def _read_marker(dataset_type: str) -> Optional[Dict[str, str]]:
+    """读取属于本次运行的完成标记，不存在或属于之前的运行时返回None"""
+    try:
+        with open(_ready_marker(dataset_type), "rb") as f:
+            marker = orjson.loads(f.read())
+    except (OSError, ValueError):
+        # 标记不存在，或0号进程正在写入
+        return None
+    if not isinstance(marker, dict) or marker.get("run") != _run_token():
+        return None
+    return marker
+
+def _wait_for_rank0(dataset_type: str) -> None:
+    """
+    非0号进程等待0号进程完成数据集的下载和处理
+    
+    只认可本次运行写入的完成标记，之前运行遗留的标记会被忽略
+    
+    参数:
+        dataset_type: 数据集类型
+    """
+    logger.info(f"进程 LOCAL_RANK={_local_rank()} 等待0号进程准备{dataset_type}数据集...")
+    deadline = time.monotonic() + DOWNLOAD_WAIT_TIMEOUT
+    while (marker := _read_marker(dataset_type)) is None:
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"等待0号进程准备{dataset_type}数据集超时")
+        time.sleep(DOWNLOAD_POLL_INTERVAL)
+    
+    if marker.get("status") != "ok":
+        raise RuntimeError(f"0号进程准备{dataset_type}数据集失败: {marker.get('error', '')}")
+    
+    # 0号进程可能仍持有锁，等其释放后再返回
+    with _download_lock(dataset_type):
+        pass
+
 def ensure_dataset(dataset_type: str = "mldr", force_download: bool = False) -> str:
     """
     确保数据集存在，不存在则下载并处理
     
+    多进程运行时只有LOCAL_RANK为0的进程负责下载和处理，其余进程等待其完成
+    
+    参数:
+        dataset_type: 数据集类型，支持"mldr"和"msmarco"
+        force_download: 是否强制重新下载
+        
+    返回:
+        数据集路径
+    """
+    if _local_rank() != 0:
+        _wait_for_rank0(dataset_type)
+        return get_default_dataset_path(dataset_type)
+    
+    with _download_lock(dataset_type):
+        marker = _ready_marker(dataset_type)
+        if os.path.exists(marker):
+            os.remove(marker)
+        
+        try:
+            dataset_path = _prepare_dataset(dataset_type, force_download)
+        except BaseException as e:
+            # 写入失败标记，其余进程立即报错而不是等到超时
+            _write_marker(dataset_type, "failed", f"{type(e).__name__}: {e}")
+            raise
+        
+        _write_marker(dataset_type, "ok")
+    
+    return dataset_path
+
+def _dataset_fingerprint(input_dir: str) -> Dict[str, Any]:
+    """
+    计算save_to_disk保存的数据集的指纹，数据集重新保存后指纹随之变化
+    
+    目录本身的修改时间在覆盖其中的文件时不会改变，因此使用state.json中记录的
+    _fingerprint以及各分片的文件名、大小和修改时间
+    
+    参数:
+        input_dir: save_to_disk保存的数据集目录
+        
+    返回:
+        可序列化为JSON的指纹字典
+    """
+    with open(os.path.join(input_dir, "state.json"), "r", encoding="utf-8") as f:
+        state = json.load(f)
+    files = []
+    for data_file in state["_data_files"]:
+        stat = os.stat(os.path.join(input_dir, data_file["filename"]))
+        files.append([data_file["filename"], stat.st_size, stat.st_mtime_ns])
+    return {"fingerprint": state.get("_fingerprint"), "files": files}
+
+def _fingerprint_path(export_path: str) -> str:
+    """返回记录导出文件对应数据集指纹的文件路径"""
+    return export_path + ".source.json"
+
+def _write_export(input_dir: str, export_path: str) -> int:
+    """
+    导出数据集记录，并在导出完成后记录数据集指纹，供下次判断导出文件是否过期
+    
+    参数:
+        input_dir: save_to_disk保存的数据集目录
+        export_path: 导出文件路径
+        
+    返回:
+        写入的记录数
+    """
+    # 先删除旧指纹，导出中途失败时不会留下与导出文件不符的指纹
+    fingerprint_path = _fingerprint_path(export_path)
+    if os.path.exists(fingerprint_path):
+        os.remove(fingerprint_path)
+    
+    count = _write_json_records(input_dir, export_path)
+    with open(fingerprint_path, "wb") as f:
+        f.write(orjson.dumps(_dataset_fingerprint(input_dir)))
+    return count
+
+def _export_is_fresh(dataset_type: str, paths: Dict[str, str]) -> bool:
+    """
+    判断导出的JSON文件是否存在且由当前的处理后数据集导出
+    
+    参数:
+        dataset_type: 数据集类型
+        paths: check_dataset_exists返回的路径信息
+        
+    返回:
+        bool: 导出文件是否可直接复用
+    """
+    export_path = os.path.join(paths["export"], f"{dataset_type}_samples.json")
+    if not os.path.exists(export_path):
+        return False
+    try:
+        with open(_fingerprint_path(export_path), "rb") as f:
+            saved = orjson.loads(f.read())
+        return saved == _dataset_fingerprint(paths["processed"])
+    except (OSError, ValueError, KeyError):
+        return False
+
+def _prepare_dataset(dataset_type: str, force_download: bool) -> str:
+    """
+    检查数据集状态，按需下载、处理并导出数据集，调用方需持有下载锁
+    
     参数:
         dataset_type: 数据集类型，支持"mldr"和"msmarco"
         force_download: 是否强制重新下载
@@ -124,9 +368,15 @@ def ensure_dataset(dataset_type: str = "mldr", force_download: bool = False) ->
     返回:
         数据集路径
     """
-    # 检查数据集状态
+    # 检查数据集状态，先清除上次调用遗留的目录缓存
+    _dir_cache.clear()
     raw_exists, processed_exists, status_info = check_dataset_exists(dataset_type)
     
+    # 0. 处理后数据和导出文件都已存在且导出文件由当前数据集导出时，直接返回
+    if not force_download and processed_exists and _export_is_fresh(dataset_type, status_info["paths"]):
+        logger.info(f"{dataset_type}数据集及其JSON导出均已存在，跳过准备步骤")
+        return get_default_dataset_path(dataset_type)
+    
     # 1. 如果强制下载或原始数据不存在，则下载数据集
     if force_download or not raw_exists:
         if dataset_type == "mldr":
@@ -155,9 +405,13 @@ def ensure_dataset(dataset_type: str = "mldr", force_download: bool = False) ->
                 output_dir=config["output_dir"]
             )
             logger.info(f"MS MARCO数据集下载完成，保存在 {config['output_dir']}")
+        
+        # 下载后目录已变化，重新检查
+        _dir_cache.clear()
+        _cached_load.cache_clear()
+        raw_exists, processed_exists, status_info = check_dataset_exists(dataset_type)
     
     # 2. 如果原始数据存在但处理后的数据不存在(或强制下载)，则处理数据
-    raw_exists, processed_exists, status_info = check_dataset_exists(dataset_type)
     if (raw_exists or force_download) and (not processed_exists or force_download):
         if dataset_type == "mldr":
             logger.info("正在处理MLDR数据集...")
@@ -171,15 +425,19 @@ def ensure_dataset(dataset_type: str = "mldr", force_download: bool = False) ->
                 output_dir=config["output_dir"],
                 language=config["language"],
                 split=config["split_to_use"],
-                samples=config["samples"]
+                samples=config["samples"],
+                sampling=config["sampling"]
             )
             logger.info(f"MLDR数据集处理完成，处理后数据保存在 {config['output_dir']}")
+        
+        # 转换后目录已变化，重新检查，确认数据集已准备好
+        _dir_cache.clear()
+        _cached_load.cache_clear()
+        raw_exists, processed_exists, status_info = check_dataset_exists(dataset_type)
     
     # 3. 导出为JSON格式
     export_dataset_to_json(dataset_type)
     
-    # 再次检查，确认数据集已准备好
-    raw_exists, processed_exists, status_info = check_dataset_exists(dataset_type)
     if not processed_exists:
         raise FileNotFoundError(f"无法找到或准备{dataset_type}数据集，请检查数据路径和下载过程")
     
@@ -191,6 +449,108 @@ def ensure_dataset(dataset_type: str = "mldr", force_download: bool = False) ->
     
     raise ValueError(f"不支持的数据集类型: {dataset_type}")
 
+def _list_arrow_shards(input_dir: str) -> List[str]:
+    """
+    按state.json中记录的顺序列出save_to_disk生成的Arrow分片路径
+    
+    参数:
+        input_dir: save_to_disk保存的数据集目录
+        
+    返回:
+        分片文件路径列表
+    """
+    with open(os.path.join(input_dir, "state.json"), "r", encoding="utf-8") as f:
+        data_files = json.load(f)["_data_files"]
+    return [os.path.join(input_dir, data_file["filename"]) for data_file in data_files]
+
+def _read_through(path: str) -> None:
+    """顺序读完整个文件并丢弃内容，仅用于把文件载入页缓存"""
+    buffer = bytearray(WARMUP_CHUNK_SIZE)
+    with open(path, "rb", buffering=0) as f:
+        while f.readinto(buffer):
+            pass
+
+def _warm_page_cache(paths: List[str]) -> None:
+    """
+    预热分片的页缓存，使随后的顺序扫描不再受单线程I/O限制
+    
+    支持posix_fadvise的系统(Linux)上一次性向内核提交所有分片的异步预读请求，
+    由内核批量调度I/O，不占用用户态线程；其他系统退回到多线程并行读取
+    
+    参数:
+        paths: 分片文件路径列表
+    """
+    if hasattr(os, "posix_fadvise"):
+        for path in paths:
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+            finally:
+                os.close(fd)
+        return
+    
+    if len(paths) < 2:
+        return
+    with ThreadPoolExecutor(max_workers=min(os.cpu_count() or 1, len(paths))) as executor:
+        list(executor.map(_read_through, paths))
+
+@functools.lru_cache(maxsize=4)
+def _cached_load(input_dir: str, fingerprint: bytes) -> pa.Table:
+    """
+    以内存映射方式加载save_to_disk生成的Arrow分片，结果按路径和数据集指纹缓存，
+    同一进程内重复导出时不再重新映射和解析分片，数据集重新保存后则重新加载
+    
+    分片先预热页缓存，再以Arrow IPC流格式零拷贝读取，不经过load_from_disk和pandas
+    
+    参数:
+        input_dir: 数据集目录的绝对路径
+        fingerprint: 序列化后的数据集指纹，仅用作缓存键
+        
+    返回:
+        由所有分片拼接而成的Arrow表
+    """
+    shards = _list_arrow_shards(input_dir)
+    _warm_page_cache(shards)
+    return pa.concat_tables([pa.ipc.open_stream(pa.memory_map(shard)).read_all() for shard in shards])
+
+def _iter_arrow_batches(input_dir: str, batch_size: int = EXPORT_BATCH_SIZE):
+    """
+    按分片顺序逐批读取数据集记录
+    
+    参数:
+        input_dir: save_to_disk保存的数据集目录
+        batch_size: 每批最多包含的记录数
+        
+    返回:
+        pyarrow.RecordBatch迭代器
+    """
+    fingerprint = orjson.dumps(_dataset_fingerprint(input_dir))
+    table = _cached_load(os.path.abspath(input_dir), fingerprint)
+    return iter(table.to_batches(max_chunksize=batch_size))
+
+def _write_json_records(input_dir: str, export_path: str, batch_size: int = EXPORT_BATCH_SIZE) -> int:
+    """
+    分批将数据集记录流式写入JSON数组文件，内存占用与批大小成正比
+    
+    参数:
+        input_dir: save_to_disk保存的数据集目录
+        export_path: 导出文件路径
+        batch_size: 每批读取的记录数
+        
+    返回:
+        写入的记录数
+    """
+    count = 0
+    with open(export_path, "wb") as f:
+        f.write(b"[")
+        for batch in _iter_arrow_batches(input_dir, batch_size):
+            for record in batch.to_pylist():
+                f.write(b",\n" if count else b"\n")
+                f.write(orjson.dumps(record, option=orjson.OPT_NON_STR_KEYS))
+                count += 1
+        f.write(b"\n]\n")
+    return count
+
 def export_dataset_to_json(dataset_type: str = "mldr") -> Optional[str]:
     """
     将数据集导出为JSON格式
@@ -223,13 +583,9 @@ def export_dataset_to_json(dataset_type: str = "mldr") -> Optional[str]:
                 logger.warning(f"MLDR处理后数据集不存在: {input_dir}")
                 return None
             
-            # 加载数据集
+            # 直接从Arrow分片流式导出为JSON
             try:
-                dataset = load_from_disk(input_dir)
-                
-                # 转换为DataFrame再导出为JSON
-                df = dataset.to_pandas()
-                df.to_json(export_path, orient="records", force_ascii=False, indent=2)
+                _write_export(input_dir, export_path)
                 
                 logger.info(f"已将MLDR数据集导出为JSON: {export_path}")
                 return export_path
@@ -256,13 +612,9 @@ def export_dataset_to_json(dataset_type: str = "mldr") -> Optional[str]:
                 logger.warning(f"MS MARCO数据集不存在: {input_dir}")
                 return None
             
-            # 加载数据集
+            # 直接从Arrow分片流式导出为JSON
             try:
-                dataset = load_from_disk(input_dir)
-                
-                # 转换为DataFrame再导出为JSON
-                df = dataset.to_pandas()
-                df.to_json(export_path, orient="records", force_ascii=False, indent=2)
+                _write_export(input_dir, export_path)
                 
                 logger.info(f"已将MS MARCO数据集导出为JSON: {export_path}")
                 return export_path
@@ -309,16 +661,22 @@ def ensure_all_datasets(force_download: bool = False) -> Dict[str, str]:
     """
     dataset_paths = {}
     
-    # 处理所有支持的数据集类型
-    for dataset_type in DEFAULT_DATASETS.keys():
-        try:
+    # 各数据集的下载、转换和导出互不依赖(各自持有独立的下载锁)，并发执行，
+    # 使一个数据集的转换与另一个数据集的下载相互重叠
+    with ThreadPoolExecutor(max_workers=len(DEFAULT_DATASETS)) as executor:
+        futures = {}
+        for dataset_type in DEFAULT_DATASETS.keys():
             logger.info(f"确保{dataset_type}数据集可用...")
-            path = ensure_dataset(dataset_type, force_download)
-            dataset_paths[dataset_type] = path
-            logger.info(f"{dataset_type}数据集已准备就绪: {path}")
-        except Exception as e:
-            logger.error(f"准备{dataset_type}数据集时出错: {e}")
-            # 继续处理其他数据集，不中断流程
+            futures[dataset_type] = executor.submit(ensure_dataset, dataset_type, force_download)
+        
+        for dataset_type, future in futures.items():
+            try:
+                path = future.result()
+                dataset_paths[dataset_type] = path
+                logger.info(f"{dataset_type}数据集已准备就绪: {path}")
+            except Exception as e:
+                logger.error(f"准备{dataset_type}数据集时出错: {e}")
+                # 继续处理其他数据集，不中断流程
     
     return dataset_paths
 
@@ -3,12 +3,25 @@
 """
 
 import os
+import logging
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
 from datasets import load_dataset
-from ragas import EvaluationDataset
 from ragas.metrics import AspectCritic
 from ragas import evaluate
 from src.custom_api_client import LangchainCustomLLMWrapper
 
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# 从MS MARCO训练集开头读取的样本数
+MSMARCO_SAMPLES = 5000
+
+# 保存到磁盘时单个Arrow分片的大小上限，大数据集会被拆成多个分片以便并行读取
+MAX_SHARD_SIZE = "50MB"
+
 def download_dataset(dataset="msmarco", output_dir="data/msmarco_for_ragas"):
     """
     下载指定数据集并保存到指定目录
@@ -20,7 +33,7 @@ def download_dataset(dataset="msmarco", output_dir="data/msmarco_for_ragas"):
     返回:
         bool: 下载是否成功
     """
-    print(f"开始下载数据集: {dataset}")
+    logger.info(f"开始下载数据集: {dataset}")
     
     # 确保输出目录存在
     os.makedirs(output_dir, exist_ok=True)
@@ -28,17 +41,53 @@ def download_dataset(dataset="msmarco", output_dir="data/msmarco_for_ragas"):
     if dataset.lower() == "msmarco":
         try:
             # 下载并准备MS MARCO数据集
-            prepared_dataset = download_and_prepare_msmarco(output_dir)
+            download_and_prepare_msmarco(output_dir)
             return True
         except Exception as e:
-            print(f"下载MS MARCO数据集失败: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception(f"下载MS MARCO数据集失败: {e}")
             return False
     else:
-        print(f"不支持的数据集: {dataset}")
+        logger.error(f"不支持的数据集: {dataset}")
         return False
 
+def _build_ragas_table(table):
+    """
+    将MS MARCO的Arrow表转换为Ragas评估格式的Arrow表
+    
+    只保留有答案且至少有一个被选中段落的样本，被选中的段落作为上下文
+    
+    参数:
+        table: MS MARCO原始数据(Arrow表)
+        
+    返回:
+        包含question、contexts、answer、ground_truths列的Arrow表
+    """
+    answers = table.column("answers").combine_chunks()
+    passages = table.column("passages").combine_chunks()
+    
+    # 展开所有段落，用is_selected掩码选出相关段落，并记录其所属样本的行号
+    texts = pc.struct_field(passages, "passage_text")
+    selected = pc.not_equal(pc.list_flatten(pc.struct_field(passages, "is_selected")), 0)
+    parents = pc.filter(pc.list_parent_indices(texts), selected)
+    contexts_values = pc.filter(pc.list_flatten(texts), selected)
+    
+    # 按每个样本选中的段落数重新组装为列表列
+    counts = np.bincount(parents.to_numpy(), minlength=len(table))
+    offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int32)
+    contexts = pa.ListArray.from_arrays(pa.array(offsets), contexts_values)
+    
+    # 只有当有上下文和答案时才添加
+    has_answer = pc.fill_null(pc.greater(pc.list_value_length(answers), 0), False)
+    keep = pc.and_(has_answer, pa.array(counts > 0))
+    answers = answers.filter(keep)
+    
+    return pa.table({
+        "question": table.column("query").filter(keep),
+        "contexts": contexts.filter(keep),
+        "answer": pc.list_element(answers, 0),
+        "ground_truths": answers
+    })
+
 def download_and_prepare_msmarco(output_dir="data/msmarco_for_ragas"):
     """
     下载MS MARCO数据集并准备用于Ragas评估，保存到指定目录
@@ -49,52 +98,32 @@ def download_and_prepare_msmarco(output_dir="data/msmarco_for_ragas"):
     返回:
         prepared_dataset: 准备好的数据集
     """
-    print("开始下载MS MARCO数据集...")
+    logger.info("开始下载MS MARCO数据集...")
     # 加载MS MARCO数据集，这是一个大型问答数据集
     # 仅加载一个较小的子集用于测试 - v2.1格式
-    dataset = load_dataset("ms_marco", "v2.1", split="train[:5000]")
+    # 以流式方式只读取开头的样本，不下载和准备整个训练集
+    stream = load_dataset("ms_marco", "v2.1", split="train", streaming=True).take(MSMARCO_SAMPLES)
+    schema = stream.features.arrow_schema if stream.features is not None else None
+    table = pa.Table.from_pylist(list(stream), schema=schema)
     
-    print(f"数据集加载完成，大小: {len(dataset)} 个样本")
-    print(f"数据集结构: {dataset.column_names}")
+    logger.info(f"数据集加载完成，大小: {table.num_rows} 个样本")
+    logger.info(f"数据集结构: {table.column_names}")
     
     # 将MS MARCO数据集转换为Ragas评估数据集格式
     # MS MARCO有passages列表和答案，我们需要重组
-    print("准备评估数据集...")
-    
-    # 构建Ragas需要的数据格式
-    ragas_data = {
-        "question": [],
-        "contexts": [],
-        "answer": [],
-        "ground_truths": []
-    }
-    
-    # 从MS MARCO数据集中提取数据
-    for sample in dataset:
-        # 只处理有答案的数据
-        if len(sample['answers']) > 0:
-            question = sample['query']
-            # 获取相关段落作为上下文
-            contexts = []
-            for i, is_selected in enumerate(sample['passages']['is_selected']):
-                if is_selected:
-                    contexts.append(sample['passages']['passage_text'][i])
-            
-            # 只有当有上下文和答案时才添加
-            if contexts and sample['answers']:
-                ragas_data["question"].append(question)
-                ragas_data["contexts"].append(contexts)
-                ragas_data["answer"].append(sample['answers'][0])
-                ragas_data["ground_truths"].append([ans for ans in sample['answers']])
-    
-    print(f"准备完成 {len(ragas_data['question'])} 个有效样本")
+    logger.info("准备评估数据集...")
+    
+    # 直接在Arrow表上按列构建Ragas格式，避免逐样本的Python循环和类型推断
+    table = _build_ragas_table(table)
+    
+    logger.info(f"准备完成 {len(table)} 个有效样本")
     
     # 保存数据集以备将来使用
     from datasets import Dataset as HFDataset
-    prepared_dataset = HFDataset.from_dict(ragas_data)
-    prepared_dataset.save_to_disk(output_dir)
+    prepared_dataset = HFDataset(table)
+    prepared_dataset.save_to_disk(output_dir, max_shard_size=MAX_SHARD_SIZE)
     
-    print(f"数据集已保存到 {output_dir}")
+    logger.info(f"数据集已保存到 {output_dir}")
     return prepared_dataset
 
 def download_and_prepare_dataset():
@@ -107,7 +136,7 @@ def evaluate_with_dataset(dataset):
     """
     使用下载的数据集进行Ragas评估
     """
-    print("\n开始使用MS MARCO数据集进行评估...")
+    logger.info("开始使用MS MARCO数据集进行评估...")
     
     # 创建评估指标
     accuracy_critic = AspectCritic(
@@ -132,7 +161,7 @@ def evaluate_with_dataset(dataset):
         )
         
         # 在评估时指定LLM
-        print("\n正在进行评估，这可能需要一些时间...")
+        logger.info("正在进行评估，这可能需要一些时间...")
         result = evaluate(
             dataset=test_dataset,
             metrics=[accuracy_critic, completeness_critic],
@@ -140,32 +169,30 @@ def evaluate_with_dataset(dataset):
         )
         
         # 输出结果
-        print("\n评估结果:")
+        logger.info("评估结果:")
         if hasattr(result, '_scores_dict'):
             scores_dict = result._scores_dict
-            print(scores_dict)
+            logger.info(scores_dict)
             for metric_name in scores_dict:
                 try:
-                    print(f"{metric_name}: {scores_dict[metric_name]:.4f}")
+                    logger.info(f"{metric_name}: {scores_dict[metric_name]:.4f}")
                 except:
-                    print(f"{metric_name}: {scores_dict[metric_name]}")
+                    logger.info(f"{metric_name}: {scores_dict[metric_name]}")
         else:
-            print(result)
+            logger.info(result)
             for metric_name in ["accuracy", "completeness"]:
                 if hasattr(result, metric_name):
                     value = getattr(result, metric_name)
                     try:
-                        print(f"{metric_name}: {value:.4f}")
+                        logger.info(f"{metric_name}: {value:.4f}")
                     except:
-                        print(f"{metric_name}: {value}")
+                        logger.info(f"{metric_name}: {value}")
                 else:
-                    print(f"{metric_name}: 无法获取结果")
+                    logger.warning(f"{metric_name}: 无法获取结果")
                 
     except Exception as e:
-        print(f"评估过程中出现错误: {e}")
-        import traceback
-        traceback.print_exc()
-        print("注意: 请确保API连接正常，并且API服务支持ragas所需的功能")
+        logger.exception(f"评估过程中出现错误: {e}")
+        logger.warning("注意: 请确保API连接正常，并且API服务支持ragas所需的功能")
 
 if __name__ == "__main__":
     # 创建数据目录(如果不存在)
@@ -173,7 +200,7 @@ if __name__ == "__main__":
     
     # 检查数据集是否已下载
     if os.path.exists("data/msmarco_for_ragas"):
-        print("使用已下载的数据集...")
+        logger.info("使用已下载的数据集...")
         from datasets import Dataset as HFDataset
         dataset = HFDataset.load_from_disk("data/msmarco_for_ragas")
     else:
@@ -181,14 +208,14 @@ if __name__ == "__main__":
         dataset = download_and_prepare_dataset()
     
     # 输出数据集大小和前几个示例
-    print(f"处理后的数据集大小: {len(dataset)} 个样本")
+    logger.info(f"处理后的数据集大小: {len(dataset)} 个样本")
     if len(dataset) > 0:
-        print("\n数据集前3个示例:")
+        logger.info("数据集前3个示例:")
         for i in range(min(3, len(dataset))):
-            print(f"\n示例 {i+1}:")
-            print(f"问题: {dataset[i]['question']}")
-            print(f"上下文片段数: {len(dataset[i]['contexts'])}")
-            print(f"答案: {dataset[i]['answer']}")
+            logger.info(f"示例 {i+1}:")
+            logger.info(f"问题: {dataset[i]['question']}")
+            logger.info(f"上下文片段数: {len(dataset[i]['contexts'])}")
+            logger.info(f"答案: {dataset[i]['answer']}")
     
     # 使用数据集进行评估
     evaluate_with_dataset(dataset) 
\ No newline at end of file
@@ -8,8 +8,28 @@ MLDR数据集下载脚本
 
 import os
 import argparse
-from datasets import load_dataset
+import contextlib
+import datasets
+import huggingface_hub.constants
+from datasets import DownloadConfig, DownloadMode, load_dataset
+from concurrent.futures import ThreadPoolExecutor
 import time
+import logging
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# 分割内不使用多进程时，同时下载的数据分割数上限
+MAX_DOWNLOAD_WORKERS = 4
+
+# 单个文件下载失败时的重试次数，以及每个分割内并行下载和生成数据文件的进程数
+# 进程数大于1时各分割依次下载，避免在多线程进程中fork进程池导致死锁
+DOWNLOAD_MAX_RETRIES = 5
+DOWNLOAD_NUM_PROC = 4
+
+# 保存到磁盘时单个Arrow分片的大小上限，大数据集会被拆成多个分片以便并行读取
+MAX_SHARD_SIZE = "50MB"
 
 def parse_args():
     """解析命令行参数"""
@@ -17,57 +37,123 @@ def parse_args():
     parser.add_argument("--language", type=str, default="zh", help="要下载的语言代码, 默认为中文(zh)")
     parser.add_argument("--output_dir", type=str, default="data/mldr", help="数据集保存目录")
     parser.add_argument("--splits", type=str, default="train,dev,test,corpus", help="要下载的数据集分割，用逗号分隔")
+    parser.add_argument("--offline", action="store_true", help="离线模式，只使用本地缓存，不访问Hugging Face Hub")
+    parser.add_argument("--num_proc", type=int, default=DOWNLOAD_NUM_PROC, help="每个分割内并行下载和生成数据文件的进程数，大于1时依次下载各分割，为1时改为多个分割并发下载")
     return parser.parse_args()
 
-def download_mldr(language="zh", output_dir="data/mldr", splits=None):
-    """下载MLDR数据集的指定语言部分"""
+# 离线模式相关的环境变量，以及datasets和huggingface_hub在导入时由其得到的常量
+OFFLINE_ENV_VARS = ("HF_DATASETS_OFFLINE", "HF_HUB_OFFLINE")
+OFFLINE_CONSTANTS = (
+    (datasets.config, "HF_DATASETS_OFFLINE"),
+    (datasets.config, "HF_HUB_OFFLINE"),
+    (huggingface_hub.constants, "HF_HUB_OFFLINE")
+)
+
+@contextlib.contextmanager
+def offline_mode():
+    """
+    临时切换到离线模式，期间的load_dataset只读取本地缓存，不再向Hub发送元数据请求
+    
+    两个库都只在导入时读取环境变量，因此同时更新已加载的常量；退出时全部恢复原值，不影响进程中的其他下载
+    """
+    saved_env = {name: os.environ.get(name) for name in OFFLINE_ENV_VARS}
+    saved_constants = [(module, name, getattr(module, name)) for module, name in OFFLINE_CONSTANTS]
+    try:
+        for name in OFFLINE_ENV_VARS:
+            os.environ[name] = "1"
+        for module, name, _ in saved_constants:
+            setattr(module, name, True)
+        yield
+    finally:
+        for name, value in saved_env.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        for module, name, value in saved_constants:
+            setattr(module, name, value)
+
+def _download_split(language, output_dir, split, download_config, num_proc):
+    """
+    下载单个数据分割并保存到磁盘
+    
+    参数:
+        language: 语言代码
+        output_dir: 数据集保存目录
+        split: 数据分割名称，"corpus"表示语料库
+        download_config: 共享的下载配置，每次调用使用其副本
+        num_proc: 生成数据文件的进程数，为None时单进程处理；数据文件只有一个时datasets也会自动退回单进程
+    """
+    load_kwargs = {
+        "split": split,
+        "trust_remote_code": True,
+        "download_config": download_config.copy(),
+        "download_mode": DownloadMode.REUSE_DATASET_IF_EXISTS,
+        "num_proc": num_proc
+    }
+    start_time = time.time()
+    if split == "corpus":
+        # 语料库需要特殊处理
+        corpus_name = f"corpus-{language}"
+        split_name = "corpus"
+        logger.info(f"下载语料库 ({corpus_name})...")
+        corpus = load_dataset("Shitao/MLDR", corpus_name, **load_kwargs)
+        save_path = os.path.join(output_dir, f"{language}-{split_name}")
+        corpus.save_to_disk(save_path, max_shard_size=MAX_SHARD_SIZE)
+        logger.info(f"语料库已保存到: {save_path}")
+        logger.info(f"语料库大小: {len(corpus)} 条文档")
+    else:
+        # 下载普通分割数据
+        logger.info(f"下载 {split} 数据集...")
+        dataset = load_dataset("Shitao/MLDR", language, **load_kwargs)
+        save_path = os.path.join(output_dir, f"{language}-{split}")
+        dataset.save_to_disk(save_path, max_shard_size=MAX_SHARD_SIZE)
+        logger.info(f"{split} 数据集已保存到: {save_path}")
+        logger.info(f"{split} 数据集大小: {len(dataset)} 条数据")
+    logger.info(f"{split} 下载耗时: {time.time() - start_time:.2f} 秒")
+
+def download_mldr(language="zh", output_dir="data/mldr", splits=None, offline=False, num_proc=DOWNLOAD_NUM_PROC):
+    """下载MLDR数据集的指定语言部分，offline为True时只使用本地缓存"""
     if splits is None:
         splits = ["train", "dev", "test"]
     
-    print(f"开始下载MLDR数据集 ({language})...")
-    print(f"数据将保存到: {output_dir}")
+    logger.info(f"开始下载MLDR数据集 ({language})...")
+    logger.info(f"数据将保存到: {output_dir}")
     
     os.makedirs(output_dir, exist_ok=True)
     
+    # 多进程和多线程只选其一：datasets的多进程使用fork启动的进程池，在其他线程运行时fork可能死锁
+    if num_proc is not None and num_proc <= 1:
+        num_proc = None
+    
+    # 所有分割共用一份下载配置
+    download_config = DownloadConfig(max_retries=DOWNLOAD_MAX_RETRIES, num_proc=num_proc)
+    
     try:
-        # 下载各个分割的数据集
-        for split in splits:
-            if split == "corpus":
-                # 语料库需要特殊处理
-                corpus_name = f"corpus-{language}"
-                split_name = "corpus"
-                print(f"下载语料库 ({corpus_name})...")
-                start_time = time.time()
-                corpus = load_dataset("Shitao/MLDR", corpus_name, split=split_name, trust_remote_code=True)
-                save_path = os.path.join(output_dir, f"{language}-{split_name}")
-                corpus.save_to_disk(save_path)
-                print(f"语料库已保存到: {save_path}")
-                print(f"语料库大小: {len(corpus)} 条文档")
-                print(f"下载耗时: {time.time() - start_time:.2f} 秒")
+        # 离线模式只在本次下载期间生效
+        with offline_mode() if offline else contextlib.nullcontext():
+            if num_proc:
+                # 每个分割内部已用多进程并行，各分割依次下载
+                for split in splits:
+                    _download_split(language, output_dir, split, download_config, num_proc)
             else:
-                # 下载普通分割数据
-                print(f"下载 {split} 数据集...")
-                start_time = time.time()
-                dataset = load_dataset("Shitao/MLDR", language, split=split, trust_remote_code=True)
-                save_path = os.path.join(output_dir, f"{language}-{split}")
-                dataset.save_to_disk(save_path)
-                print(f"{split} 数据集已保存到: {save_path}")
-                print(f"数据集大小: {len(dataset)} 条数据")
-                print(f"下载耗时: {time.time() - start_time:.2f} 秒")
+                # 各分割的下载互不依赖，并发执行以重叠网络和磁盘等待
+                with ThreadPoolExecutor(max_workers=min(MAX_DOWNLOAD_WORKERS, len(splits))) as executor:
+                    list(executor.map(lambda split: _download_split(language, output_dir, split, download_config, None), splits))
         
-        print("\n下载完成! MLDR数据集已成功下载并保存。")
-        print(f"总共下载了 {len(splits)} 个数据分割:")
+        logger.info("下载完成! MLDR数据集已成功下载并保存。")
+        logger.info(f"总共下载了 {len(splits)} 个数据分割:")
         for split in splits:
             if split == "corpus":
-                print(f"- {language}-corpus (语料库)")
+                logger.info(f"- {language}-corpus (语料库)")
             else:
-                print(f"- {language}-{split}")
+                logger.info(f"- {language}-{split}")
         
         return True
     
     except Exception as e:
-        print(f"下载过程中出现错误: {e}")
-        print("请检查网络连接或数据集名称是否正确。")
+        logger.exception(f"下载过程中出现错误: {e}")
+        logger.error("请检查网络连接或数据集名称是否正确。")
         return False
 
 def main():
@@ -81,7 +167,9 @@ def main():
     download_mldr(
         language=args.language,
         output_dir=args.output_dir,
-        splits=splits
+        splits=splits,
+        offline=args.offline,
+        num_proc=args.num_proc
     )
 
 if __name__ == "__main__":
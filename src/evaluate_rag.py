@@ -4,23 +4,331 @@
 
 import os
 import sys
+import json
 import time
+import copy
+import hashlib
+import asyncio
+import functools
+import itertools
+import threading
+import collections
 import argparse
+import logging
+import logging.handlers
 import numpy as np
+import orjson
+import pyarrow.compute as pc
 from datetime import datetime
+from typing import List, Dict, Any, Optional
 from datasets import Dataset
 from ragas import evaluate
 from ragas.metrics import AspectCritic
-from src.custom_api_client import LangchainCustomLLMWrapper
-import json
-from typing import List, Dict, Any, Optional, Union
+from langchain_core.prompt_values import StringPromptValue
+from src.custom_api_client import LangchainCustomLLMWrapper, DEFAULT_CACHE_PATH, positive_int
+
+# 可视化模块在评估前就导入，缺少依赖时只禁用可视化
+try:
+    from src.visualize import visualize_evaluation
+    _HAS_VIZ = True
+except ImportError:
+    _HAS_VIZ = False
+
+# 评估报告日志，控制台和报告文件都只输出消息本身，保持报告文本格式不变
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+logger.propagate = False
+
+# 只写入报告文件、不在控制台显示的日志
+FILE_ONLY = {"console": False}
+
+# 报告文件缓冲的日志条数，缓冲满、出现错误或评估结束时才写入磁盘
+REPORT_BUFFER_RECORDS = 64
+
+# 同时进行评估的批次数上限，受API服务商的速率限制约束
+DEFAULT_BATCH_CONCURRENCY = 4
+
+# 合并到同一次LLM请求中评分的样本数，1表示每个样本单独请求(默认)
+# 合并评分使用另一套提示词(不含ragas的推理要求和少样本示例)，分数与逐个评分不可直接比较，需显式开启
+DEFAULT_MARSHAL_SIZE = 1
+
+# ragas评估会用到的数据集列(包括旧版和新版列名)，其余列在加载后即丢弃
+RAGAS_COLUMNS = (
+    "question", "answer", "contexts", "ground_truth",
+    "user_input", "response", "retrieved_contexts", "reference"
+)
+
+# 查找重复样本时每次转换为Python对象的行数
+DEDUP_HASH_BATCH_SIZE = 1000
+
+# 查找重复样本前先统计不同取值个数的问题列(新版和旧版列名)
+DEDUP_KEY_COLUMNS = ("user_input", "question")
+
+# 凑不满一组样本时最多等待的时间(秒)，到时即发送已收集的样本
+MARSHAL_WAIT_SECONDS = 0.05
+
+class MarshaledAspectCritic(AspectCritic):
+    """
+    将多个样本合并到一次LLM请求中评分的AspectCritic
+    
+    ragas对每个样本分别调用_ascore，这里把同一事件循环中的样本先收集起来，凑满marshal_size个
+    (或等待MARSHAL_WAIT_SECONDS)后合并为一个提示词，要求LLM按顺序返回每个样本的0/1判定，
+    再把结果分发回各个样本。返回结果无法解析时退回到逐个样本评分。
+    
+    合并评分的提示词不包含ragas AspectCritic的推理要求和少样本示例，得到的分数与逐个评分的结果
+    不可直接比较，因此只在marshal_size大于1时启用。合并请求使用组内第一个样本的callbacks，
+    ragas的追踪和token用量统计对每次LLM请求只记录一次。
+    """
+    
+    def __init__(self, name: str, definition: str, marshal_size: int = DEFAULT_MARSHAL_SIZE, **kwargs):
+        super().__init__(name=name, definition=definition, **kwargs)
+        self.marshal_size = marshal_size
+        # 每个事件循环各自的待评分队列(元素为(样本, callbacks, future))和等待超时的定时器
+        self._queues: Dict[Any, list] = {}
+        self._timers: Dict[Any, asyncio.TimerHandle] = {}
+        self._queues_lock = threading.Lock()
+    
+    async def _ascore(self, row: Dict, callbacks) -> float:
+        assert self.llm is not None, "set LLM before use"
+        if self.marshal_size <= 1 or self.strictness > 1:
+            return await super()._ascore(row, callbacks)
+        
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._queues_lock:
+            queue = self._queues.setdefault(loop, [])
+        queue.append((row, callbacks, future))
+        
+        if len(queue) >= self.marshal_size:
+            self._flush(loop)
+        elif len(queue) == 1:
+            timer = loop.call_later(MARSHAL_WAIT_SECONDS, self._flush, loop)
+            with self._queues_lock:
+                self._timers[loop] = timer
+        return await future
+    
+    def _flush(self, loop) -> None:
+        """取出当前事件循环中已收集的样本，作为一组提交评分，并取消这一组的等待定时器"""
+        with self._queues_lock:
+            items = self._queues.pop(loop, [])
+            timer = self._timers.pop(loop, None)
+        # 因凑满而提前提交时取消定时器，避免它在下一组刚开始收集时把未满的一组提前提交
+        if timer is not None:
+            timer.cancel()
+        if items:
+            loop.create_task(self._score_group(items))
+    
+    async def _score_group(self, items: list) -> None:
+        """对一组样本发起一次LLM请求，并把判定结果写回各样本的future"""
+        try:
+            verdicts = None
+            if len(items) > 1:
+                try:
+                    verdicts = await self._marshaled_verdicts([row for row, _, _ in items], items[0][1])
+                except Exception:
+                    verdicts = None
+            if verdicts is None:
+                verdicts = await asyncio.gather(*[
+                    AspectCritic._ascore(self, row, callbacks) for row, callbacks, _ in items
+                ])
+            for (_, _, future), verdict in zip(items, verdicts):
+                if not future.done():
+                    future.set_result(verdict)
+        except Exception as e:
+            for _, _, future in items:
+                if not future.done():
+                    future.set_exception(e)
+    
+    async def _marshaled_verdicts(self, rows: List[Dict], callbacks=None) -> List[int]:
+        """
+        将多个样本渲染到同一个提示词中请求LLM，解析返回的JSON判定数组
+        
+        参数:
+            rows: 样本字典列表
+            callbacks: 传给LLM请求的callbacks，用于ragas的追踪和token用量统计
+            
+        返回:
+            与rows等长的0/1判定列表，解析失败时抛出ValueError
+        """
+        fields = ("user_input", "response", "retrieved_contexts", "reference", "reference_contexts")
+        parts = [
+            "Evaluate each of the following samples based on the criterial defined. "
+            "Use only 'Yes' (1) and 'No' (0) as verdict.",
+            f"Criteria Definition: {self.definition}",
+            ""
+        ]
+        for k, row in enumerate(rows, 1):
+            parts.append(f"### 样本 {k}")
+            for field in fields:
+                if row.get(field) is not None:
+                    parts.append(f"{field}: {json.dumps(row[field], ensure_ascii=False)}")
+            parts.append("")
+        parts.append(
+            f"Return only a JSON array of {len(rows)} objects in sample order, "
+            f'each like {{"index": 1, "verdict": 0}}. 只返回JSON数组，不要输出其他内容。'
+        )
+        
+        result = await self.llm.generate(StringPromptValue(text="\n".join(parts)), callbacks=callbacks)
+        text = result.generations[0][0].text
+        verdicts = json.loads(text[text.index("["):text.rindex("]") + 1])
+        verdicts = [item["verdict"] if isinstance(item, dict) else item for item in verdicts]
+        if len(verdicts) != len(rows) or any(v not in (0, 1) for v in verdicts):
+            raise ValueError(f"无法解析合并评分结果: {text}")
+        return [int(v) for v in verdicts]
 
-def create_metrics(metric_names: List[str]) -> List[AspectCritic]:
+def _as_score_array(scores) -> np.ndarray:
+    """将分数列表转换为float64数组，None记为NaN"""
+    return np.fromiter((np.nan if x is None else x for x in scores), dtype=np.float64, count=len(scores))
+
+def _format_scores(scores) -> str:
+    """
+    将分数列表格式化为报告中的一行文本
+    
+    有限值由orjson序列化；orjson会把NaN和None写为null，这里明确改写为NaN，
+    报告中缺失的分数仍可与0分区分，且Python的json.loads可以直接解析
+    
+    参数:
+        scores: 分数列表或数组
+        
+    返回:
+        形如[1,0,NaN]的文本
+    """
+    return orjson.dumps(scores, option=orjson.OPT_SERIALIZE_NUMPY).decode().replace("null", "NaN")
+
+def _clean_mean(scores) -> Optional[float]:
+    """
+    计算分数的平均值，忽略None和NaN
+    
+    参数:
+        scores: 分数列表或数组
+        
+    返回:
+        平均分，没有有效分数时返回None
+    """
+    a = _as_score_array(scores)
+    if np.isnan(a).all():
+        return None
+    return float(np.nanmean(a))
+
+def _update_running_stats(stats: tuple, scores) -> tuple:
+    """
+    用Welford算法(按批合并的形式)把一批分数并入累计统计量，忽略None和NaN
+    
+    参数:
+        stats: 累计统计量(count, mean, M2)
+        scores: 本批次的分数列表
+        
+    返回:
+        更新后的(count, mean, M2)
+    """
+    a = _as_score_array(scores)
+    a = a[~np.isnan(a)]
+    if not a.size:
+        return stats
+    
+    count, mean, m2 = stats
+    batch_mean = a.mean()
+    batch_m2 = np.square(a - batch_mean).sum()
+    total = count + a.size
+    delta = batch_mean - mean
+    return (
+        total,
+        mean + delta * a.size / total,
+        m2 + batch_m2 + delta * delta * count * a.size / total
+    )
+
+def _open_report_handlers(output_file: Optional[str]) -> List[logging.Handler]:
+    """
+    为一次评估配置日志处理器：控制台输出加上带缓冲的报告文件输出
+    
+    参数:
+        output_file: 评估报告文件路径，为空时只输出到控制台
+        
+    返回:
+        已添加到logger的处理器列表，评估结束后传给_close_report_handlers
+    """
+    formatter = logging.Formatter("%(message)s")
+    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler.setFormatter(formatter)
+    console_handler.addFilter(lambda record: getattr(record, "console", True))
+    handlers = [console_handler]
+    
+    if output_file:
+        os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+        file_handler = logging.FileHandler(output_file, mode='w', encoding='utf-8', delay=True)
+        file_handler.setFormatter(formatter)
+        handlers.append(logging.handlers.MemoryHandler(
+            REPORT_BUFFER_RECORDS, flushLevel=logging.ERROR, target=file_handler
+        ))
+    
+    for handler in handlers:
+        logger.addHandler(handler)
+    return handlers
+
+def _close_report_handlers(handlers: List[logging.Handler]) -> None:
+    """写出缓冲的日志并移除本次评估添加的处理器"""
+    for handler in handlers:
+        logger.removeHandler(handler)
+        # MemoryHandler关闭时写出缓冲并解除target引用，需要先取出target再单独关闭
+        target = getattr(handler, "target", None)
+        handler.close()
+        if target is not None:
+            target.close()
+
+def _find_duplicate_rows(dataset: Dataset, sample_count: int, batch_size: int = DEDUP_HASH_BATCH_SIZE) -> tuple:
+    """
+    找出前sample_count个样本中内容完全相同的行
+    
+    重复样本很少见，先在Arrow上统计问题列的不同取值个数，问题互不相同时样本必然互不相同，
+    直接返回；否则每行序列化后取blake2b摘要作为键，只在内存中保留摘要和行号
+    
+    参数:
+        dataset: 数据集
+        sample_count: 参与评估的样本数
+        batch_size: 每次转换为Python对象的行数
+        
+    返回:
+        (unique_rows, inverse)：unique_rows为每组相同样本第一次出现的行号(升序)，
+        inverse[j]为第j个样本在unique_rows中的位置
+    """
+    table = dataset.data.table.slice(0, sample_count)
+    for column in DEDUP_KEY_COLUMNS:
+        if column in table.column_names:
+            if pc.count_distinct(table.column(column)).as_py() == sample_count:
+                rows = np.arange(sample_count, dtype=np.int64)
+                return rows, rows
+            break
+    
+    first_seen = {}
+    unique_rows = []
+    inverse = np.empty(sample_count, dtype=np.int64)
+    j = 0
+    for record_batch in table.to_batches(max_chunksize=batch_size):
+        for row in record_batch.to_pylist():
+            key = hashlib.blake2b(orjson.dumps(row), digest_size=16).digest()
+            position = first_seen.get(key)
+            if position is None:
+                position = first_seen[key] = len(unique_rows)
+                unique_rows.append(j)
+            inverse[j] = position
+            j += 1
+    return np.asarray(unique_rows, dtype=np.int64), inverse
+
+def _render_visualization(report_file: str, vis_file: str) -> None:
+    """在后台线程中根据评估报告生成可视化HTML"""
+    try:
+        visualize_evaluation(report_file, vis_file)
+    except Exception as e:
+        print(f"生成可视化过程中出错: {e}")
+
+def create_metrics(metric_names: List[str], marshal_size: int = DEFAULT_MARSHAL_SIZE) -> List[AspectCritic]:
     """
     创建评估指标
     
     参数:
         metric_names: 指标名称列表
+        marshal_size: 合并到同一次LLM请求中评分的样本数，1表示每个样本单独请求(使用ragas原有的提示词)；
+            大于1时使用合并评分的提示词，分数与逐个评分的结果不可直接比较
         
     返回:
         指标对象列表
@@ -37,10 +345,17 @@ def create_metrics(metric_names: List[str]) -> List[AspectCritic]:
     
     for name in metric_names:
         if name in metrics_definitions:
-            metrics.append(AspectCritic(
-                name=name,
-                definition=metrics_definitions[name]
-            ))
+            if marshal_size > 1:
+                metrics.append(MarshaledAspectCritic(
+                    name=name,
+                    definition=metrics_definitions[name],
+                    marshal_size=marshal_size
+                ))
+            else:
+                metrics.append(AspectCritic(
+                    name=name,
+                    definition=metrics_definitions[name]
+                ))
         else:
             print(f"警告: 未知的评估指标 '{name}'，已忽略")
     
@@ -56,7 +371,10 @@ def evaluate_dataset(
     visualize: bool = False,
     api_key: Optional[str] = None,
     api_base_url: Optional[str] = None,
-    api_model: Optional[str] = None
+    api_model: Optional[str] = None,
+    max_concurrency: int = DEFAULT_BATCH_CONCURRENCY,
+    llm_wrapper: Optional[LangchainCustomLLMWrapper] = None,
+    llm_cache_path: Optional[str] = None
 ) -> Dict[str, Any]:
     """
     评估数据集
@@ -66,163 +384,246 @@ def evaluate_dataset(
         sample_count: 要评估的样本数量，0表示全部
         metrics: 评估指标列表
         output_file: 评估结果输出文件路径，不指定则只输出到控制台
-        json_output: 评估结果JSON格式输出文件路径，便于可视化
+        json_output: 评估结果JSON格式输出文件路径，保存汇总统计；逐样本分数按批次写入同名的.ndjson文件
         batch_size: 批处理大小，避免一次性评估太多样本
         visualize: 评估完成后是否直接生成可视化结果
         api_key: API密钥，直接从main.py传递
         api_base_url: API基础URL，直接从main.py传递
         api_model: 模型名称，直接从main.py传递
+        max_concurrency: 同时评估的批次数上限
+        llm_wrapper: 预先创建的LLM客户端，多次评估时复用同一个客户端和响应缓存；为None时根据API参数创建
+        llm_cache_path: LLM响应缓存文件路径，为None时不缓存；只在根据API参数创建客户端时使用
         
     返回:
         评估结果字典
     """
-    # 设置输出目标
-    original_stdout = sys.stdout
-    file_out = None
-    
-    if output_file:
-        os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
-        file_out = open(output_file, 'w', encoding='utf-8')
+    if max_concurrency < 1:
+        raise ValueError(f"max_concurrency必须至少为1，当前为{max_concurrency}")
     
-    def log(message, to_console=True):
-        """同时输出到文件和控制台"""
-        if file_out:
-            print(message, file=file_out, flush=True)
-        if to_console:
-            print(message, flush=True)
+    # 设置输出目标，日志处理器在入口处一次性配置好
+    details_out = None
+    report_handlers = _open_report_handlers(output_file)
     
     try:
         # 输出评估信息头部
         current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        log(f"=========== RAG系统评估报告 ===========")
-        log(f"评估时间: {current_time}")
-        log(f"数据集路径: {dataset_path}")
-        log(f"评估指标: {', '.join([m.name for m in metrics])}")
-        log("=======================================\n")
+        logger.info(f"=========== RAG系统评估报告 ===========")
+        logger.info(f"评估时间: {current_time}")
+        logger.info(f"数据集路径: {dataset_path}")
+        logger.info(f"评估指标: {', '.join([m.name for m in metrics])}")
+        logger.info("=======================================\n")
         
         # 加载数据集
         if os.path.exists(dataset_path):
-            log(f"加载数据集: {dataset_path}")
+            logger.info(f"加载数据集: {dataset_path}")
             dataset = Dataset.load_from_disk(dataset_path)
+            
+            # 只保留ragas需要的列，避免每个批次都搬运用不到的宽列
+            unused_columns = [c for c in dataset.column_names if c not in RAGAS_COLUMNS]
+            if len(unused_columns) < len(dataset.column_names):
+                dataset = dataset.remove_columns(unused_columns)
         else:
-            log(f"错误: 数据集路径不存在: {dataset_path}")
+            logger.info(f"错误: 数据集路径不存在: {dataset_path}")
             return {}
         
         # 检查和处理样本数量
         total_samples = len(dataset)
         if sample_count <= 0 or sample_count > total_samples:
             sample_count = total_samples
-            log(f"将评估全部 {total_samples} 个样本")
+            logger.info(f"将评估全部 {total_samples} 个样本")
         else:
-            log(f"数据集总样本数: {total_samples}")
-            log(f"将评估 {sample_count} 个样本")
+            logger.info(f"数据集总样本数: {total_samples}")
+            logger.info(f"将评估 {sample_count} 个样本")
         
-        # 创建LLM客户端，直接使用传入的API参数
-        llm_wrapper = LangchainCustomLLMWrapper(
-            api_key=api_key,
-            api_url=api_base_url,
-            model_name=api_model
-        )
-        log(f"使用API: {llm_wrapper.client.api_url}")
-        log(f"使用模型: {llm_wrapper.client.model_name}")
+        # 创建LLM客户端，未传入时直接使用传入的API参数
+        if llm_wrapper is None:
+            llm_wrapper = LangchainCustomLLMWrapper(
+                api_key=api_key,
+                api_url=api_base_url,
+                model_name=api_model,
+                cache_path=llm_cache_path
+            )
+        logger.info(f"使用API: {llm_wrapper.client.api_url}")
+        logger.info(f"使用模型: {llm_wrapper.client.model_name}")
         
         # 批量评估，避免一次性处理太多样本
-        all_results = {}
+        # 每个批次的分数写入NDJSON明细文件，各指标累计(count, mean, M2)；
+        # 报告的原始分数部分只需每个样本一个float64，按去重后的样本序号填入
+        running_stats = {}
+        raw_scores = {}
+        details_path = None
+        if json_output:
+            details_path = os.path.splitext(json_output)[0] + ".ndjson"
+            os.makedirs(os.path.dirname(os.path.abspath(details_path)), exist_ok=True)
+            details_out = open(details_path, 'wb')
+        
+        # 内容完全相同的样本只评估一次，汇总统计时按重复次数计入
+        unique_rows, inverse = _find_duplicate_rows(dataset, sample_count)
+        eval_count = len(unique_rows)
+        if eval_count < sample_count:
+            logger.info(f"发现 {sample_count - eval_count} 个重复样本，只评估 {eval_count} 个不重复的样本")
+            multiplicity = np.bincount(inverse, minlength=eval_count)
+        else:
+            unique_rows = None
         
         # 计时
         start_time = time.time()
         
-        # 分批处理
-        for i in range(0, sample_count, batch_size):
-            batch_end = min(i + batch_size, sample_count)
-            progress_msg = f"\n正在评估批次 {i//batch_size + 1}/{(sample_count+batch_size-1)//batch_size}: 样本 {i+1}-{batch_end}/{sample_count}"
-            log(progress_msg)
-            
-            # 准备评估数据集
-            test_dataset = dataset.select(range(i, batch_end))
-            
-            # 运行评估
-            batch_start_time = time.time()
-            try:
+        # 预先计算每个批次的(批次号, 起始位置, 结束位置, 总批次数)，位置均为去重后的样本序号
+        total_batches = (eval_count + batch_size - 1) // batch_size
+        batches = [
+            (k + 1, k * batch_size, min((k + 1) * batch_size, eval_count), total_batches)
+            for k in range(total_batches)
+        ]
+        
+        async def _run_batch(semaphore, batch):
+            """在线程池中评估一个批次，信号量限制同时进行的批次数"""
+            batch_idx, start, end, total = batch
+            async with semaphore:
+                progress_msg = f"\n正在评估批次 {batch_idx}/{total}: 样本 {start+1}-{end}/{eval_count}"
+                logger.info(progress_msg)
+                
+                # 准备评估数据集，没有重复样本时直接对内存映射的Arrow表切片，不经过select的索引映射和指纹计算
+                if unique_rows is None:
+                    test_dataset = Dataset(dataset.data.slice(start, end - start), info=dataset.info)
+                else:
+                    test_dataset = dataset.select(unique_rows[start:end])
+                
                 # 评估前输出信息
-                log(f"开始评估批次 {i//batch_size + 1}...", to_console=True)
+                logger.info(f"开始评估批次 {batch_idx}...")
                 
-                result = evaluate(
-                    dataset=test_dataset,
-                    metrics=metrics,
-                    llm=llm_wrapper
+                # ragas只提供同步接口，放到线程中运行，使多个批次的API请求相互重叠；
+                # evaluate会临时设置并在结束时清空指标的llm，并发批次各自使用指标的浅拷贝
+                batch_metrics = [copy.copy(metric) for metric in metrics]
+                batch_start_time = time.time()
+                loop = asyncio.get_running_loop()
+                result = await loop.run_in_executor(
+                    None,
+                    functools.partial(evaluate, dataset=test_dataset, metrics=batch_metrics, llm=llm_wrapper)
                 )
-                
-                # 提取结果
-                if hasattr(result, '_scores_dict'):
-                    scores_dict = result._scores_dict
-                    for metric_name, scores in scores_dict.items():
-                        if metric_name not in all_results:
-                            all_results[metric_name] = []
-                        all_results[metric_name].extend(scores)
-                    
-                    # 输出当前批次结果
-                    log(f"\n批次 {i//batch_size + 1} 评估结果:", to_console=False)
-                    for metric_name, scores in scores_dict.items():
-                        log(f"{metric_name}: {scores}", to_console=False)
-                    
-                    # 在控制台输出简要结果
-                    for metric_name, scores in scores_dict.items():
-                        if scores:
-                            valid_scores = [x for x in scores if x is not None and not np.isnan(x)]
-                            if valid_scores:
-                                avg = np.mean(valid_scores)
-                                log(f"批次 {i//batch_size + 1} {metric_name} 平均分: {avg:.4f}")
-                else:
-                    log("无法获取结果分数字典")
-                    
-            except Exception as e:
-                log(f"批次 {i//batch_size + 1} 评估过程中出现错误: {e}")
-                if file_out:
-                    import traceback
-                    traceback.print_exc(file=file_out)
-                log("继续评估下一批次...")
-                continue
+                return result, time.time() - batch_start_time
+        
+        async def _run_all_batches():
+            """并发评估所有批次，并按批次顺序汇总结果"""
+            semaphore = asyncio.Semaphore(max_concurrency)
             
-            batch_time = time.time() - batch_start_time
-            log(f"批次 {i//batch_size + 1} 耗时: {batch_time:.2f} 秒")
+            # 只提前调度有限个批次：已完成但还没轮到汇总的结果最多保留window个，
+            # 内存占用只与批次大小和并发数有关，与数据集大小无关
+            window = 2 * max_concurrency
+            schedule = iter(batches)
+            pending = collections.deque()
             
-            # 输出总进度
-            elapsed = time.time() - start_time
-            remaining = (elapsed / (i + batch_size)) * (sample_count - (i + batch_size)) if i + batch_size < sample_count else 0
-            log(f"总进度: {min((i + batch_size), sample_count)}/{sample_count} 样本, 已用时: {elapsed:.2f}秒, 预计剩余: {remaining:.2f}秒")
+            def _schedule_more():
+                for batch in itertools.islice(schedule, window - len(pending)):
+                    pending.append((batch, asyncio.ensure_future(_run_batch(semaphore, batch))))
+            
+            # 按批次顺序依次等待结果，各批次在后台仍然并发执行；
+            # 日志只在事件循环线程中写出，不会与其他批次交错
+            _schedule_more()
+            while pending:
+                (batch_idx, start, end, total), task = pending.popleft()
+                _schedule_more()
+                try:
+                    result, batch_time = await task
+                    
+                    # 提取结果
+                    if hasattr(result, '_scores_dict'):
+                        scores_dict = result._scores_dict
+                        for metric_name, scores in scores_dict.items():
+                            # 重复样本的分数按出现次数计入统计
+                            weighted_scores = scores if unique_rows is None else np.repeat(
+                                _as_score_array(scores), multiplicity[start:end]
+                            )
+                            running_stats[metric_name] = _update_running_stats(
+                                running_stats.get(metric_name, (0, 0.0, 0.0)), weighted_scores
+                            )
+                            if metric_name not in raw_scores:
+                                raw_scores[metric_name] = np.full(eval_count, np.nan)
+                            raw_scores[metric_name][start:end] = _as_score_array(scores)
+                            if details_out:
+                                record = {
+                                    "batch": batch_idx,
+                                    "start": start,
+                                    "metric": metric_name,
+                                    "scores": scores
+                                }
+                                if unique_rows is not None:
+                                    record["rows"] = unique_rows[start:end]
+                                details_out.write(orjson.dumps(record, option=orjson.OPT_SERIALIZE_NUMPY) + b"\n")
+                        
+                        # 输出当前批次结果，整个结果块作为一条日志写出
+                        score_lines = "\n".join(
+                            f"{metric_name}: {_format_scores(scores)}"
+                            for metric_name, scores in scores_dict.items()
+                        )
+                        logger.info(f"\n批次 {batch_idx} 评估结果:\n{score_lines}", extra=FILE_ONLY)
+                        
+                        # 在控制台输出简要结果
+                        for metric_name, scores in scores_dict.items():
+                            avg = _clean_mean(scores)
+                            if avg is not None:
+                                logger.info(f"批次 {batch_idx} {metric_name} 平均分: {avg:.4f}")
+                    else:
+                        logger.info("无法获取结果分数字典")
+                        
+                except Exception as e:
+                    logger.exception(f"批次 {batch_idx} 评估过程中出现错误: {e}")
+                    logger.info("继续评估下一批次...")
+                    continue
+                
+                logger.info(f"批次 {batch_idx} 耗时: {batch_time:.2f} 秒")
+                
+                # 输出总进度
+                elapsed = time.time() - start_time
+                remaining = (elapsed / end) * (eval_count - end)
+                logger.info(f"总进度: {end}/{eval_count} 样本, 已用时: {elapsed:.2f}秒, 预计剩余: {remaining:.2f}秒")
+        
+        # 分批并发处理
+        asyncio.run(_run_all_batches())
         
         # 评估完成，输出统计结果
         total_time = time.time() - start_time
-        log("\n=========== 评估完成 ===========")
-        log(f"总耗时: {total_time:.2f} 秒")
-        log(f"评估样本数: {sample_count}")
-        log(f"每样本平均耗时: {total_time/sample_count:.2f} 秒")
-        log("=================================\n")
+        logger.info("\n=========== 评估完成 ===========")
+        logger.info(f"总耗时: {total_time:.2f} 秒")
+        logger.info(f"评估样本数: {sample_count}")
+        logger.info(f"每样本平均耗时: {total_time/sample_count:.2f} 秒")
+        logger.info("=================================\n")
+        
+        if details_out:
+            details_out.close()
+            details_out = None
         
         # 处理汇总结果
         summary_results = {}
-        if all_results:
-            log("\n========== 汇总结果 ==========")
-            log("\n原始分数:", to_console=False)
-            for metric_name, scores in all_results.items():
-                log(f"{metric_name}: {scores}", to_console=False)
+        statistics = {}
+        if running_stats:
+            logger.info("\n========== 汇总结果 ==========")
+            
+            # 原始分数按原样本顺序输出，重复样本取其首次出现时的分数，评估失败的批次记为NaN
+            logger.info("\n原始分数:", extra=FILE_ONLY)
+            for metric_name, scores in raw_scores.items():
+                if unique_rows is not None:
+                    scores = scores[inverse]
+                logger.info(f"{metric_name}: {_format_scores(scores)}", extra=FILE_ONLY)
             
-            # 计算和输出平均分
-            log("\n平均分:")
-            for metric_name, scores in all_results.items():
-                valid_scores = [x for x in scores if x is not None and not np.isnan(x)]
-                if valid_scores:
-                    avg = np.mean(valid_scores)
-                    summary_results[metric_name] = avg
-                    log(f"{metric_name}: {avg:.4f}")
+            # 输出平均分
+            logger.info("\n平均分:")
+            for metric_name, (count, mean, m2) in running_stats.items():
+                if count:
+                    summary_results[metric_name] = float(mean)
+                    statistics[metric_name] = {
+                        "count": int(count),
+                        "mean": float(mean),
+                        "std": float(np.sqrt(m2 / count))
+                    }
+                    logger.info(f"{metric_name}: {mean:.4f}")
                 else:
-                    log(f"{metric_name}: 无有效分数")
-            log("=================================\n")
+                    logger.info(f"{metric_name}: 无有效分数")
+            logger.info("=================================\n")
         
         # 保存JSON结果
         if json_output:
-            log(f"\n保存JSON格式评估结果到: {json_output}")
+            logger.info(f"\n保存JSON格式评估结果到: {json_output}")
             full_results = {
                 "timestamp": current_time,
                 "dataset_path": dataset_path,
@@ -230,46 +631,56 @@ def evaluate_dataset(
                 "evaluated_samples": sample_count,
                 "metrics": [m.name for m in metrics],
                 "summary": summary_results,
-                "details": all_results,
+                "statistics": statistics,
+                "details_file": details_path,
                 "api_info": {
                     "api_url": llm_wrapper.client.api_url,
                     "model": llm_wrapper.client.model_name
                 }
             }
+            if unique_rows is not None:
+                # 重复样本的行号及其对应的首次出现行号，明细文件中只记录首次出现的样本
+                duplicate_rows = np.flatnonzero(unique_rows[inverse] != np.arange(sample_count))
+                full_results["duplicates"] = {
+                    "rows": duplicate_rows.tolist(),
+                    "duplicate_of": unique_rows[inverse[duplicate_rows]].tolist()
+                }
             try:
                 os.makedirs(os.path.dirname(os.path.abspath(json_output)), exist_ok=True)
-                with open(json_output, 'w', encoding='utf-8') as f:
-                    json.dump(full_results, f, ensure_ascii=False, indent=2)
-                log("JSON结果文件保存成功。")
+                with open(json_output, 'wb') as f:
+                    f.write(orjson.dumps(full_results, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_INDENT_2))
+                logger.info("JSON结果文件保存成功。")
             except Exception as e:
-                log(f"保存JSON结果文件时出错: {e}")
+                logger.info(f"保存JSON结果文件时出错: {e}")
         
-        # 如果需要可视化
+        # 如果需要可视化，可视化解析的是文本评估报告，在后台线程中生成，函数可以直接返回
         if visualize:
-            log("\n正在生成可视化结果...")
-            try:
-                from src.visualize import create_visualization
-                if json_output:
-                    vis_file = json_output.replace(".json", "_viz.html")
-                    create_visualization(json_output, vis_file)
-                    log(f"可视化结果已保存到: {vis_file}")
-                else:
-                    log("无JSON结果文件，无法生成可视化。")
-            except Exception as e:
-                log(f"生成可视化过程中出错: {e}")
+            if not _HAS_VIZ:
+                logger.info("\n可视化模块不可用，跳过生成可视化。")
+            elif output_file:
+                logger.info("\n正在后台生成可视化结果...")
+                for handler in report_handlers:
+                    handler.flush()
+                vis_file = os.path.splitext(output_file)[0] + "_viz.html"
+                threading.Thread(
+                    target=_render_visualization,
+                    args=(output_file, vis_file),
+                    name="visualize"
+                ).start()
+            else:
+                logger.info("\n无评估报告文件，无法生成可视化。")
         
         return summary_results
     
     except Exception as e:
-        log(f"评估过程中出现错误: {e}")
-        import traceback
-        traceback.print_exc(file=file_out)
+        logger.exception(f"评估过程中出现错误: {e}")
         return {}
     
     finally:
         # 关闭文件输出
-        if file_out:
-            file_out.close()
+        if details_out:
+            details_out.close()
+        _close_report_handlers(report_handlers)
 
 # 当直接运行此脚本时
 if __name__ == "__main__":
@@ -282,6 +693,9 @@ if __name__ == "__main__":
     parser.add_argument("--batch-size", type=int, default=5, help="批处理大小")
     parser.add_argument("--metrics", type=str, default="accuracy,completeness,relevance", help="评估指标，用逗号分隔")
     parser.add_argument("--visualize", action="store_true", help="评估完成后直接生成可视化结果")
+    parser.add_argument("--concurrency", type=positive_int, default=DEFAULT_BATCH_CONCURRENCY, help="同时评估的批次数")
+    parser.add_argument("--marshal-size", type=int, default=DEFAULT_MARSHAL_SIZE, help="合并到同一次LLM请求中评分的样本数，1表示逐个评分；大于1时使用不同的提示词，分数与逐个评分不可直接比较")
+    parser.add_argument("--llm-cache", action="store_true", help=f"缓存LLM响应到{DEFAULT_CACHE_PATH}，重复评估时复用")
     parser.add_argument("--api-key", type=str, required=True, help="API密钥")
     parser.add_argument("--api-url", type=str, default="https://api.ppai.pro/v1/chat/completions", help="API基础URL")
     parser.add_argument("--model", type=str, default="gpt-4o-2024-11-20", help="模型名称")
@@ -290,7 +704,15 @@ if __name__ == "__main__":
     
     # 创建评估指标
     metric_names = args.metrics.split(",")
-    metrics = create_metrics(metric_names)
+    metrics = create_metrics(metric_names, args.marshal_size)
+    
+    # 创建LLM客户端
+    llm_wrapper = LangchainCustomLLMWrapper(
+        api_key=args.api_key,
+        api_url=args.api_url,
+        model_name=args.model,
+        cache_path=DEFAULT_CACHE_PATH if args.llm_cache else None
+    )
     
     # 运行评估
     evaluate_dataset(
@@ -303,5 +725,7 @@ if __name__ == "__main__":
         visualize=args.visualize,
         api_key=args.api_key,
         api_base_url=args.api_url,
-        api_model=args.model
+        api_model=args.model,
+        max_concurrency=args.concurrency,
+        llm_wrapper=llm_wrapper
     ) 
\ No newline at end of file
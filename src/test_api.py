@@ -2,9 +2,10 @@
 简单的API测试脚本，验证自定义API连接是否正常
 """
 
-import json
+import io
 import time
-from typing import Dict, Any, Optional, List, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, TextIO
 from src.custom_api_client import CustomLLMClient
 
 class ApiTester:
@@ -31,56 +32,62 @@ class ApiTester:
             model_name=self.model_name
         )
     
-    def test_normal_call(self) -> bool:
+    def test_normal_call(self, out: Optional[TextIO] = None) -> bool:
         """
         测试普通（非流式）API调用
         
+        参数:
+            out: 测试输出写入的文件对象，为None时写入标准输出
+        
         返回:
             bool: 测试是否通过
         """
-        print("测试非流式API调用...")
+        print("测试非流式API调用...", file=out)
         try:
             start_time = time.time()
             response = self.client._call("Say 'Hello, API test is working!' in Chinese")
             end_time = time.time()
             
-            print(f"响应时间: {end_time - start_time:.2f} 秒")
-            print(f"API响应内容: {response}")
-            print("非流式API测试成功!")
+            print(f"响应时间: {end_time - start_time:.2f} 秒", file=out)
+            print(f"API响应内容: {response}", file=out)
+            print("非流式API测试成功!", file=out)
             return True
         except Exception as e:
-            print(f"非流式API测试失败: {e}")
+            print(f"非流式API测试失败: {e}", file=out)
             return False
     
-    def test_stream_call(self) -> bool:
+    def test_stream_call(self, out: Optional[TextIO] = None) -> bool:
         """
         测试流式API调用
         
+        参数:
+            out: 测试输出写入的文件对象，为None时写入标准输出
+        
         返回:
             bool: 测试是否通过
         """
-        print("\n测试流式API调用...")
+        print("\n测试流式API调用...", file=out)
         try:
             start_time = time.time()
             full_text = ""
             
-            print("流式响应开始接收:")
-            print("-" * 40)
+            print("流式响应开始接收:", file=out)
+            print("-" * 40, file=out)
             
             # 使用generator获取流式响应
             for chunk in self.client.stream_chat("Count from 1 to 5 in Chinese, one number per line."):
                 if chunk:
                     full_text += chunk
-                    print(chunk, end="", flush=True)
+                    print(chunk, end="", flush=True, file=out)
             
             end_time = time.time()
-            print("\n" + "-" * 40)
-            print(f"流式响应总时间: {end_time - start_time:.2f} 秒")
-            print(f"接收到的完整文本长度: {len(full_text)} 字符")
-            print("流式API测试成功!")
+            print("\n" + "-" * 40, file=out)
+            print(f"流式响应总时间: {end_time - start_time:.2f} 秒", file=out)
+            print(f"接收到的完整文本长度: {len(full_text)} 字符", file=out)
+            print("流式API测试成功!", file=out)
             return True
         except Exception as e:
-            print(f"流式API测试失败: {e}")
+            print(f"流式API测试失败: {e}", file=out)
             return False
     
     def run_all_tests(self) -> Dict[str, bool]:
@@ -92,13 +99,18 @@ class ApiTester:
         """
         print("开始API测试...\n")
         
-        results = {}
-        
-        # 测试非流式API
-        results["normal_call"] = self.test_normal_call()
+        # 两项测试互不依赖，同时发起；各自的输出写入自己的缓冲区，结束后按顺序打印，避免交错
+        tests = {
+            "normal_call": self.test_normal_call,
+            "stream_call": self.test_stream_call
+        }
+        buffers = {name: io.StringIO() for name in tests}
+        with ThreadPoolExecutor(max_workers=len(tests)) as executor:
+            futures = {name: executor.submit(test, buffers[name]) for name, test in tests.items()}
+            results = {name: future.result() for name, future in futures.items()}
         
-        # 测试流式API
-        results["stream_call"] = self.test_stream_call()
+        for buffer in buffers.values():
+            print(buffer.getvalue(), end="")
         
         # 总结测试结果
         print("\nAPI测试结果总结:")
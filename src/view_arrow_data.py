@@ -9,13 +9,18 @@ Arrow数据文件查看工具
 import os
 import argparse
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
 from datasets import load_from_disk
 
+# 导出JSON时每批写入的记录数
+EXPORT_BATCH_SIZE = 10_000
+
 def parse_args():
     """解析命令行参数"""
     parser = argparse.ArgumentParser(description="Arrow数据查看工具")
     parser.add_argument("--input_dir", type=str, required=True, help="Arrow数据集目录路径")
-    parser.add_argument("--output", type=str, default="", help="导出文件路径，支持.csv/.json/.xlsx格式")
+    parser.add_argument("--output", type=str, default="", help="导出文件路径，支持.csv/.json(JSON Lines)/.xlsx格式")
     parser.add_argument("--limit", type=int, default=10, help="显示的记录数量，默认10条")
     parser.add_argument("--columns", type=str, default="", help="要显示的列，多列用逗号分隔，默认显示所有列")
     return parser.parse_args()
@@ -36,16 +41,17 @@ def view_arrow_data(input_dir, output="", limit=10, columns=""):
         # 选择要显示的列
         selected_columns = columns.split(",") if columns else None
         
-        # 转换为DataFrame以便更好地展示
+        # 先裁剪列，后续预览和导出都只读取需要的列
         if selected_columns and all(col in dataset.features.keys() for col in selected_columns):
-            df = dataset.select_columns(selected_columns).to_pandas()
-        else:
-            df = dataset.to_pandas()
+            dataset = dataset.select_columns(selected_columns)
+        
+        # 只把要显示的前N条记录转换为DataFrame
+        preview = dataset.select(range(max(0, min(limit, len(dataset))))).to_pandas()
         
         # 显示前N条记录
-        print(f"\n前{min(limit, len(df))}条记录:")
+        print(f"\n前{len(preview)}条记录:")
         pd.set_option('display.max_colwidth', 50)  # 设置列宽，避免文本太长
-        print(df.head(limit))
+        print(preview)
         
         # 导出数据（如果指定了输出路径）
         if output:
@@ -57,13 +63,20 @@ def view_arrow_data(input_dir, output="", limit=10, columns=""):
             ext = os.path.splitext(output)[1].lower()
             
             if ext == '.csv':
-                df.to_csv(output, index=False, encoding='utf-8')
+                # pyarrow的CSV写入器不支持列表等嵌套类型，这类数据集交给datasets分批写出
+                table = dataset.data.table
+                if any(pa.types.is_nested(field.type) for field in table.schema):
+                    dataset.to_csv(output, batch_size=EXPORT_BATCH_SIZE, index=False, encoding='utf-8')
+                else:
+                    pa_csv.write_csv(table, output)
                 print(f"\n数据已导出为CSV: {output}")
             elif ext == '.json':
-                df.to_json(output, orient='records', force_ascii=False, indent=2)
-                print(f"\n数据已导出为JSON: {output}")
+                # 按批流式写出JSON Lines，每行一条记录
+                dataset.to_json(output, batch_size=EXPORT_BATCH_SIZE, force_ascii=False)
+                print(f"\n数据已导出为JSON Lines: {output}")
             elif ext == '.xlsx':
-                df.to_excel(output, index=False)
+                # pyarrow没有Excel写入器，仅此格式经由pandas
+                dataset.to_pandas().to_excel(output, index=False)
                 print(f"\n数据已导出为Excel: {output}")
             else:
                 print(f"\n不支持的导出格式: {ext}，支持的格式为.csv/.json/.xlsx")
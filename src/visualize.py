@@ -1,11 +1,70 @@
 import os
 import re
+import ast
+import html
+import mmap
+import functools
 import pandas as pd
 import json
 import numpy as np
 import argparse
 from datetime import datetime
 
+# 解析评估结果文件用到的正则表达式，在模块加载时编译一次
+# 文件以内存映射方式读取，模式均为bytes，只对捕获到的片段解码
+# 批次结果块的标题，相邻两个标题之间即为一个批次的结果
+_HEADER_RE = re.compile("批次 (\\d+) 评估结果:".encode("utf-8"))
+
+# 按行切分解析时用到的批次标题前后缀
+_HEADER_PREFIX = "批次 ".encode("utf-8")
+_HEADER_SUFFIX = " 评估结果:".encode("utf-8")
+
+# 批次结果块中可能出现的字段
+_FIELD_NAMES = (
+    'user_input', 'retrieved_contexts', 'response', 'reference',
+    'context_precision', 'answer_relevancy', 'faithfulness', 'context_recall',
+    'context_entities_recall', 'accuracy', 'completeness', 'relevance'
+)
+_FIELD_KEYS = tuple(field_name.encode() for field_name in _FIELD_NAMES)
+_FIELD_NAME_SET = frozenset(_FIELD_KEYS)
+
+# 所有字段合并为一个带命名分组的模式，在所属批次的文本范围内一次扫描
+_FIELD_RE = re.compile(
+    rf"^(?P<field>{'|'.join(_FIELD_NAMES)}): (?P<value>\[.*?\])".encode(), re.MULTILINE
+)
+
+# 逐个提取单个指标结果的模式
+_METRIC_RES = {
+    metric_name: re.compile(rf"{metric_name}: (\[.*?\])".encode())
+    for metric_name in (
+        'accuracy', 'completeness', 'relevance', 'context_precision',
+        'answer_relevancy', 'faithfulness', 'context_recall', 'context_entities_recall'
+    )
+}
+
+# 构建DataFrame时已知列的类型，无法转换的列(如包含非数值的指标)保持推断出的类型
+_COLUMN_DTYPES = {
+    'batch': 'int64',
+    'index': 'int64',
+    **{metric_name: 'float64' for metric_name in _METRIC_RES}
+}
+
+# 提取单个评估分数的模式
+_SINGLE_RE = re.compile(rb"(accuracy|completeness|relevance|context_precision|answer_relevancy|faithfulness|context_recall|context_entities_recall): ([\d\.]+)")
+
+# 文件中的一行(不含换行符)，逐个匹配可以避免一次性复制整个文件内容
+_LINE_RE = re.compile(rb"[^\n]+")
+
+# 分数列表中Python格式的nan(不在字符串内时)
+_NAN_RE = re.compile(r"(?<![\w.'\"])nan(?![\w'\"])")
+
+# 单元格文本的HTML转义，同一文本(如重复的上下文、参考答案)只转义一次
+_escape = functools.lru_cache(maxsize=4096)(html.escape)
+
+def _decode(data):
+    """将捕获到的字节片段解码为文本，忽略无法解码的字节"""
+    return data.decode('utf-8', errors='ignore')
+
 def parse_evaluation_file(file_path):
     """
     解析评估结果文件，提取批次评估结果
@@ -16,124 +75,166 @@ def parse_evaluation_file(file_path):
     Returns:
         list: 包含评估结果数据的列表
     """
-    with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-        content = f.read()
+    # 内存映射文件，直接在映射的字节上解析，不把整个文件解码为字符串
+    with open(file_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            # 空文件无法映射
+            return _parse_content(b"")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as content:
+            return _parse_content(content)
+
+def _batch_rows(batch_num, raw_fields):
+    """
+    解析一个批次的各字段列表并展开为逐条结果记录
     
-    # 提取所有批次的评估结果
-    batch_results = []
+    Args:
+        batch_num (int): 批次编号
+        raw_fields (dict): 字段名(bytes)到列表原始文本(bytes)的映射
+        
+    Returns:
+        list: 该批次的结果记录
+    """
+    # 缺少的字段记为空列表
+    fields = {
+        field_name: safe_eval(_decode(raw_fields[key])) if key in raw_fields else []
+        for field_name, key in zip(_FIELD_NAMES, _FIELD_KEYS)
+    }
+    
+    # 确定结果数量（使用最长的指标列表长度）
+    max_len = max([len(values) for values in fields.values()]) if fields.values() else 0
+    
+    rows = []
+    for i in range(max_len):
+        result = {
+            'batch': batch_num,
+            'index': i
+        }
+        
+        # 为每个字段安全获取值
+        for field_name, values in fields.items():
+            if i < len(values):
+                result[field_name] = values[i]
+            else:
+                result[field_name] = np.nan
+        
+        rows.append(result)
+    return rows
+
+def _parse_fast(content):
+    """
+    按评估脚本写出的固定格式逐行切分解析，不经过正则
+    
+    每个批次以"批次 N 评估结果:"一行开头，其后每行为"字段名: [...]"
+    
+    Args:
+        content (bytes-like): 文件内容
+        
+    Returns:
+        list: 包含评估结果数据的列表，格式不符时为空列表
+    """
+    batches = []
+    fields = None
+    for line_match in _LINE_RE.finditer(content):
+        line = line_match.group().rstrip(b"\r")
+        if line.startswith(_HEADER_PREFIX) and line.endswith(_HEADER_SUFFIX):
+            batch_num = line[len(_HEADER_PREFIX):-len(_HEADER_SUFFIX)]
+            if batch_num.isdigit():
+                fields = {}
+                batches.append((int(batch_num), fields))
+                continue
+        if fields is None:
+            continue
+        field_name, _, value = line.partition(b": ")
+        # 同一批次中重复出现的字段以第一次为准
+        if value.startswith(b"[") and field_name in _FIELD_NAME_SET and field_name not in fields:
+            fields[field_name] = value
     
-    # 尝试匹配更多字段的模式
-    expanded_pattern = r"批次 (\d+) 评估结果:\n(?:.*?user_input: (\[.*?\]).*?)?(?:.*?retrieved_contexts: (\[.*?\]).*?)?(?:.*?response: (\[.*?\]).*?)?(?:.*?reference: (\[.*?\]).*?)?(?:.*?context_precision: (\[.*?\]).*?)?(?:.*?answer_relevancy: (\[.*?\]).*?)?(?:.*?faithfulness: (\[.*?\]).*?)?(?:.*?context_recall: (\[.*?\]).*?)?(?:.*?context_entities_recall: (\[.*?\]).*?)?(?:.*?accuracy: (\[.*?\]).*?)?(?:.*?completeness: (\[.*?\]).*?)?(?:.*?relevance: (\[.*?\]).*?)?"
+    batch_results = []
+    for batch_num, fields in batches:
+        batch_results.extend(_batch_rows(batch_num, fields))
+    return batch_results
+
+def _scan_block(content, start, end):
+    """
+    用正则在一个批次的文本范围内扫描出所有字段
     
-    # 首先尝试使用扩展模式
-    batch_matches = list(re.finditer(expanded_pattern, content, re.DOTALL))
+    Args:
+        content (bytes-like): 文件内容
+        start (int): 批次文本起始位置
+        end (int): 批次文本结束位置
+        
+    Returns:
+        dict: 字段名(bytes)到列表原始文本(bytes)的映射，同一字段以第一次出现为准
+    """
+    found = {}
+    for match in _FIELD_RE.finditer(content, start, end):
+        groups = match.groupdict()
+        found.setdefault(groups['field'], groups['value'])
+    return found
+
+def _parse_content(content):
+    """
+    从评估结果文件内容中提取批次评估结果
     
-    # 如果扩展模式没有匹配到任何结果，尝试使用基本模式
-    if not batch_matches:
-        print("使用基本匹配模式...")
-        batch_pattern = r"批次 (\d+) 评估结果:\naccuracy: (\[.*?\])\ncompleteness: (\[.*?\])\nrelevance: (\[.*?\])"
-        batch_matches = list(re.finditer(batch_pattern, content))
+    Args:
+        content (bytes-like): 文件内容
         
-        # 如果仍然没有匹配，尝试提取单个指标
-        if not batch_matches:
-            print("使用单指标匹配模式...")
-            # 逐个提取不同指标的结果
-            metrics = {
-                'accuracy': r"accuracy: (\[.*?\])",
-                'completeness': r"completeness: (\[.*?\])",
-                'relevance': r"relevance: (\[.*?\])",
-                'context_precision': r"context_precision: (\[.*?\])",
-                'answer_relevancy': r"answer_relevancy: (\[.*?\])",
-                'faithfulness': r"faithfulness: (\[.*?\])",
-                'context_recall': r"context_recall: (\[.*?\])",
-                'context_entities_recall': r"context_entities_recall: (\[.*?\])"
-            }
-            
-            results = {}
-            for metric_name, pattern in metrics.items():
-                matches = re.search(pattern, content)
-                if matches:
-                    try:
-                        results[metric_name] = safe_eval(matches.group(1))
-                    except:
-                        print(f"无法解析 {metric_name} 结果")
-            
-            if results:
-                # 如果至少提取到了一个指标，创建一个批次记录
-                max_len = max([len(values) for values in results.values()]) if results.values() else 0
-                for i in range(max_len):
-                    result = {'batch': 1, 'index': i}
-                    for metric, values in results.items():
-                        if i < len(values):
-                            result[metric] = values[i]
-                        else:
-                            result[metric] = np.nan
-                    batch_results.append(result)
-    else:
-        # 处理扩展模式匹配结果
-        for match in batch_matches:
-            batch_num = match.group(1)
-            
-            # 提取各个指标
-            field_mapping = {
-                'user_input': 2,
-                'retrieved_contexts': 3,
-                'response': 4,
-                'reference': 5,
-                'context_precision': 6,
-                'answer_relevancy': 7,
-                'faithfulness': 8,
-                'context_recall': 9,
-                'context_entities_recall': 10,
-                'accuracy': 11,
-                'completeness': 12,
-                'relevance': 13
-            }
-            
-            # 尝试使用扩展模式字段
-            fields = {}
-            for field_name, group_idx in field_mapping.items():
-                if group_idx <= len(match.groups()):
-                    group_value = match.group(group_idx)
-                    fields[field_name] = safe_eval(group_value) if group_value else []
-            
-            # 如果没有提取到扩展字段，使用原始字段
-            if not fields.get('accuracy') and len(match.groups()) >= 3:
-                fields['accuracy'] = safe_eval(match.group(2))
-                fields['completeness'] = safe_eval(match.group(3))
-                fields['relevance'] = safe_eval(match.group(4))
-            
-            # 确定结果数量（使用最长的指标列表长度）
-            max_len = max([len(values) for values in fields.values()]) if fields.values() else 0
-            
-            # 将每个批次的结果添加到列表中
+    Returns:
+        list: 包含评估结果数据的列表
+    """
+    # 先按固定格式快速解析，格式不符时再用正则匹配
+    batch_results = _parse_fast(content)
+    if batch_results:
+        return batch_results
+    
+    # 先定位所有批次标题，每个批次的文本从标题结束处到下一个标题开始处
+    headers = list(_HEADER_RE.finditer(content))
+    
+    # 没有批次标题时，尝试提取单个指标
+    if not headers:
+        print("使用单指标匹配模式...")
+        # 逐个提取不同指标的结果
+        results = {}
+        for metric_name, pattern in _METRIC_RES.items():
+            matches = pattern.search(content)
+            if matches:
+                try:
+                    results[metric_name] = safe_eval(_decode(matches.group(1)))
+                except:
+                    print(f"无法解析 {metric_name} 结果")
+        
+        if results:
+            # 如果至少提取到了一个指标，创建一个批次记录
+            max_len = max([len(values) for values in results.values()]) if results.values() else 0
             for i in range(max_len):
-                result = {
-                    'batch': int(batch_num),
-                    'index': i
-                }
-                
-                # 为每个字段安全获取值
-                for field_name, values in fields.items():
+                result = {'batch': 1, 'index': i}
+                for metric, values in results.items():
                     if i < len(values):
-                        result[field_name] = values[i]
+                        result[metric] = values[i]
                     else:
-                        result[field_name] = np.nan
-                
+                        result[metric] = np.nan
                 batch_results.append(result)
+    else:
+        # 各批次的文本互不重叠，逐段扫描
+        # 正则匹配和safe_eval都持有GIL，交给线程池并行反而更慢，因此保持顺序处理
+        block_ends = [header.start() for header in headers[1:]] + [len(content)]
+        for header, block_end in zip(headers, block_ends):
+            found = _scan_block(content, header.end(), block_end)
+            
+            # 将每个批次的结果添加到列表中
+            batch_results.extend(_batch_rows(int(header.group(1)), found))
     
     # 如果batch_results为空，尝试提取单个评估结果
     if not batch_results:
         print("尝试提取单个评估结果...")
-        single_result_pattern = r"(accuracy|completeness|relevance|context_precision|answer_relevancy|faithfulness|context_recall|context_entities_recall): ([\d\.]+)"
-        matches = re.findall(single_result_pattern, content)
+        matches = _SINGLE_RE.findall(content)
         if matches:
             result = {'batch': 1, 'index': 0}
             for metric, value in matches:
                 try:
-                    result[metric] = float(value)
-                except:
-                    result[metric] = np.nan
+                    result[_decode(metric)] = float(value)
+                except ValueError:
+                    result[_decode(metric)] = np.nan
             batch_results.append(result)
     
     return batch_results
@@ -150,17 +251,32 @@ def safe_eval(s):
     """
     if not s:
         return []
-    # 替换'nan'为'np.nan'，使eval可以正确处理
-    s = s.replace('nan', 'np.nan')
-    try:
-        return eval(s)
-    except:
-        # 如果解析失败，尝试使用json解析（去除单引号）
+    if "'" not in s and '"' not in s:
+        # 不含字符串的数值列表(orjson写出的分数列表或Python格式的列表)
+        # 有nan时先换成JSON的NaN，直接解析一次，不再先试一次必然失败的json.loads
+        try:
+            return json.loads(_NAN_RE.sub("NaN", s) if "nan" in s else s)
+        except ValueError:
+            pass
+    else:
+        # JSON格式的字符串列表直接解析
         try:
-            return json.loads(s.replace("'", "\""))
-        except:
-            # 如果仍然失败，返回空列表
-            return []
+            return json.loads(s)
+        except ValueError:
+            pass
+    # Python字面量格式(包含字符串的列表)，nan先记为None，解析后再换回NaN
+    try:
+        return ast.literal_eval(s)
+    except (ValueError, SyntaxError):
+        pass
+    try:
+        value = ast.literal_eval(_NAN_RE.sub("None", s))
+        if isinstance(value, list):
+            return [np.nan if item is None else item for item in value]
+        return value
+    except (ValueError, SyntaxError):
+        # 如果仍然失败，返回空列表
+        return []
 
 def truncate_text(text, max_length=50):
     """
@@ -175,46 +291,118 @@ def truncate_text(text, max_length=50):
     """
     if not isinstance(text, str):
         return text
+    return _truncate(text, max_length)
+
+@functools.lru_cache(maxsize=8192)
+def _truncate(text, max_length):
+    """截断字符串，重复出现的文本(如相同的上下文、参考答案)直接命中缓存"""
     if len(text) > max_length:
         return text[:max_length] + "..."
     return text
 
-def create_html_visualization(results):
+# 0分和1分单元格的CSS类
+_SCORE_CLASSES = {0: "score-0", 1: "score-1"}
+
+def _format_metric_cell(value):
+    """
+    生成单个指标单元格的HTML，用于非数值类型的指标列
+    
+    Args:
+        value: 指标值
+        
+    Returns:
+        str: 单元格HTML
+    """
+    if pd.isna(value):
+        return '<td class="score-nan">NaN</td>'
+    if isinstance(value, (int, float)):
+        return f'<td class="{_SCORE_CLASSES.get(value, "")}">{value:.2f}</td>'
+    return f'<td>{_escape(str(value))}</td>'
+
+def _metric_cells(values):
+    """
+    按列生成指标单元格的HTML
+    
+    Args:
+        values (pd.Series): 指标列
+        
+    Returns:
+        np.ndarray: 每行对应的单元格HTML
+    """
+    if not pd.api.types.is_numeric_dtype(values):
+        return np.array([_format_metric_cell(value) for value in values], dtype=object)
+    
+    formatted = values.map('{:.2f}'.format).to_numpy(dtype=object)
+    return np.select(
+        [values.isna().to_numpy(), (values == 0).to_numpy(), (values == 1).to_numpy()],
+        [
+            '<td class="score-nan">NaN</td>',
+            '<td class="score-0">' + formatted + '</td>',
+            '<td class="score-1">' + formatted + '</td>'
+        ],
+        default='<td class="">' + formatted + '</td>'
+    )
+
+def _content_cells(values):
+    """
+    按列生成文本字段单元格的HTML，长文本截断显示并在工具提示中展示全文，文本均经过HTML转义
+    
+    Args:
+        values (pd.Series): 文本列
+        
+    Returns:
+        np.ndarray: 每行对应的单元格HTML
+    """
+    return np.array([
+        f'<td class="tooltip"><span class="long-text">{_escape(truncate_text(value))}</span>'
+        f'<span class="tooltiptext">{_escape(value)}</span></td>'
+        if isinstance(value, str) else "<td>-</td>"
+        for value in values
+    ], dtype=object)
+
+def create_html_visualization(results, write=None):
     """
     创建HTML可视化展示
     
     Args:
         results (list): 评估结果列表
+        write (callable): 写入函数(如文件对象的write)，指定时各段HTML生成后直接写出
         
     Returns:
-        str: HTML内容
+        str: HTML内容，指定write时返回None
     """
-    # 转换为DataFrame
-    df = pd.DataFrame(results)
+    # 转换为DataFrame，列按记录中首次出现的顺序排列，已知列直接指定类型
+    columns = list(dict.fromkeys(key for result in results for key in result))
+    df = pd.DataFrame.from_records(results, columns=columns).astype(
+        {col: _COLUMN_DTYPES[col] for col in columns if col in _COLUMN_DTYPES}, errors='ignore'
+    )
     
-    # 确定有哪些指标
+    # 一次性确定实际存在的文本字段和指标，后面直接遍历这两个列表
     content_columns = ['user_input', 'retrieved_contexts', 'response', 'reference']
-    metric_columns = [col for col in df.columns if col not in ['batch', 'index'] + content_columns]
-    
-    # 计算平均评分 (忽略NaN值)
-    summary_data = {}
-    for metric in metric_columns:
-        if metric in df.columns:
-            summary_data[metric] = df[metric].mean()
-    
-    # 计算总分数 (将NaN视为0)
-    score_columns = [col for col in metric_columns if col in df.columns]
-    if score_columns:
-        df['total_score'] = df[score_columns].fillna(0).sum(axis=1)
-        metrics_count = len(score_columns)
+    non_metric_columns = {'batch', 'index', *content_columns}
+    column_set = set(df.columns)
+    content_cols = [col for col in content_columns if col in column_set]
+    metric_cols = [col for col in df.columns if col not in non_metric_columns]
+    
+    # 计算平均评分 (忽略NaN值)，所有指标列一次求均值
+    summary_data = df[metric_cols].mean(numeric_only=True).to_dict()
+    
+    # 计算总分数 (将NaN视为0)，直接在NumPy矩阵上求和，不生成fillna后的副本
+    if metric_cols:
+        scores = df[metric_cols].to_numpy(dtype=np.float64)
+        df['total_score'] = np.nansum(scores, axis=1)
+        # 总平均分即所有分数之和除以单元格数 (NaN计为0)
+        avg_total = float(np.nansum(scores)) / scores.size if scores.size else 0
     else:
         df['total_score'] = 0
-        metrics_count = 1
-    
-    avg_total = df['total_score'].mean() / metrics_count if metrics_count > 0 else 0
-    
-    # 创建HTML内容
-    html_content = f"""
+        avg_total = 0
+    
+    # 创建HTML内容，各段直接交给write写出；未指定write时先放入列表，最后一次性拼接
+    parts = None
+    if write is None:
+        parts = []
+        write = parts.append
+    write(f"""
     <!DOCTYPE html>
     <html>
     <head>
@@ -320,20 +508,20 @@ def create_html_visualization(results):
         <p>Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</p>
         
         <div class="summary-container">
-    """
+    """)
     
     # 添加指标摘要框
     for metric, value in summary_data.items():
         display_name = metric.replace('_', ' ').title()
-        html_content += f"""
+        write(f"""
             <div class="summary-box">
                 <h3>{display_name}</h3>
                 <div class="score">{value:.2f}</div>
             </div>
-        """
+        """)
     
     # 添加总体评分框
-    html_content += f"""
+    write(f"""
             <div class="summary-box">
                 <h3>Overall</h3>
                 <div class="score">{avg_total:.2f}</div>
@@ -345,62 +533,33 @@ def create_html_visualization(results):
             <tr>
                 <th>Batch</th>
                 <th>Index</th>
-    """
+    """)
     
     # 添加所有字段的表头
-    for col in content_columns:
-        if col in df.columns:
-            display_name = col.replace('_', ' ').title()
-            html_content += f"<th>{display_name}</th>\n"
+    for col in content_cols:
+        display_name = col.replace('_', ' ').title()
+        write(f"<th>{display_name}</th>\n")
     
     # 添加评估指标的表头
-    for metric in metric_columns:
-        if metric in df.columns:
-            display_name = metric.replace('_', ' ').title()
-            html_content += f"<th>{display_name}</th>\n"
+    for metric in metric_cols:
+        display_name = metric.replace('_', ' ').title()
+        write(f"<th>{display_name}</th>\n")
+    
+    write("<th>Total</th>\n</tr>\n")
     
-    html_content += "<th>Total</th>\n</tr>\n"
+    # 按列生成所有单元格，再逐行拼接，避免iterrows为每行构造Series
+    row_html = "<tr><td>" + df['batch'].astype(str).to_numpy(dtype=object) + "</td><td>" + df['index'].astype(str).to_numpy(dtype=object) + "</td>"
+    for col in content_cols:
+        row_html = row_html + _content_cells(df[col])
+    for metric in metric_cols:
+        row_html = row_html + _metric_cells(df[metric])
+    row_html = row_html + "<td>" + df['total_score'].map('{:.2f}'.format).to_numpy(dtype=object) + "</td></tr>"
     
     # 添加每一行数据
-    for _, row in df.iterrows():
-        html_content += f"""
-            <tr>
-                <td>{row['batch']}</td>
-                <td>{row['index']}</td>
-        """
-        
-        # 添加内容字段
-        for col in content_columns:
-            if col in df.columns:
-                value = row[col]
-                if isinstance(value, str):
-                    # 对长文本使用工具提示
-                    truncated = truncate_text(value)
-                    html_content += f"""
-                    <td class="tooltip">
-                        <span class="long-text">{truncated}</span>
-                        <span class="tooltiptext">{value}</span>
-                    </td>
-                    """
-                else:
-                    html_content += f"<td>-</td>"
-            
-        # 为每个指标添加适当的样式
-        for metric in metric_columns:
-            if metric in df.columns:
-                value = row[metric]
-                if pd.isna(value):
-                    html_content += f'<td class="score-nan">NaN</td>'
-                elif isinstance(value, (int, float)):
-                    css_class = f"score-{int(value)}" if value in [0, 1] else ""
-                    html_content += f'<td class="{css_class}">{value:.2f}</td>'
-                else:
-                    html_content += f'<td>{value}</td>'
-        
-        # 添加总分
-        html_content += f"<td>{row['total_score']:.2f}</td></tr>\n"
+    for row in row_html:
+        write(row + "\n")
     
-    html_content += """
+    write("""
         </table>
         
         <script>
@@ -413,9 +572,9 @@ def create_html_visualization(results):
         </script>
     </body>
     </html>
-    """
+    """)
     
-    return html_content
+    return "".join(parts) if parts is not None else None
 
 def visualize_evaluation(input_file=None, output_file=None):
     """
@@ -435,16 +594,21 @@ def visualize_evaluation(input_file=None, output_file=None):
         if not os.path.exists(eval_results_dir):
             os.makedirs(eval_results_dir)
             
-        result_files = [f for f in os.listdir(eval_results_dir) 
-                      if (f.startswith("rag_eval_") or f.endswith("_eval_results.txt"))
-                      and f.endswith(".txt")]
-        if not result_files:
+        # 单次遍历目录，选择修改时间最新的评估结果文件
+        with os.scandir(eval_results_dir) as entries:
+            latest_entry = max(
+                (entry for entry in entries
+                 if entry.name.endswith(".txt")
+                 and (entry.name.startswith("rag_eval_") or entry.name.endswith("_eval_results.txt"))
+                 and entry.is_file()),
+                key=lambda entry: entry.stat().st_mtime,
+                default=None
+            )
+        if latest_entry is None:
             print("错误：没有找到评估结果文件")
             return None
         
-        # 按修改时间排序，选择最新的文件
-        latest_file = sorted(result_files, key=lambda x: os.path.getmtime(os.path.join(eval_results_dir, x)))[-1]
-        input_file = os.path.join(eval_results_dir, latest_file)
+        input_file = latest_entry.path
         print(f"使用最新的评估结果文件: {input_file}")
     
     print(f"正在解析文件: {input_file}")
@@ -458,9 +622,6 @@ def visualize_evaluation(input_file=None, output_file=None):
     
     print(f"成功解析 {len(results)} 条评估结果")
     
-    # 创建HTML可视化
-    html_content = create_html_visualization(results)
-    
     # 生成输出文件名
     if output_file is None:
         eval_results_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "evaluation_results")
@@ -470,9 +631,9 @@ def visualize_evaluation(input_file=None, output_file=None):
     # 确保输出目录存在
     os.makedirs(os.path.dirname(output_file), exist_ok=True)
     
-    # 保存HTML文件
-    with open(output_file, 'w', encoding='utf-8') as f:
-        f.write(html_content)
+    # 创建HTML可视化，边生成边写入文件，不在内存中拼出完整文档
+    with open(output_file, 'w', encoding='utf-8', buffering=1 << 16) as f:
+        create_html_visualization(results, f.write)
     
     print(f"可视化结果已保存到: {output_file}")
     return output_file